@@ -1,11 +1,24 @@
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify, Response
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, ImageMessage, TextSendMessage
+from linebot.models import (
+    MessageEvent, TextMessage, ImageMessage, VideoMessage, AudioMessage, FileMessage, TextSendMessage
+)
 import os
+import hmac
 import logging
-from datetime import datetime
-from google_sheets_oauth import GoogleSheetsOAuthHandler as GoogleSheetsHandler
+from storage_backends import create_storage_backend
+from shutdown import ShutdownCoordinator
+from upload_executor import OrderedUploadExecutor
+from fair_scheduler import FairScheduler, UserRateLimiter
+from user_state import UserSaveStates
+from tracing import tracer
+from profiler import sample_stacks, format_collapsed, ProfilerBusyError
+from daily_summary import DailySummary
+from search_index import SearchIndex
+from startup_rebuild import StartupRebuild
+from export_sheet import iter_sheet_rows
+from sheet_row import SheetRow, format_timestamp
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,40 +29,185 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TracedLineBotApi(LineBotApi):
+    """在追蹤中記錄回覆訊息花費的時間"""
+
+    def reply_message(self, *args, **kwargs):
+        with tracer.span('line.reply_message', kind='CLIENT'):
+            return super().reply_message(*args, **kwargs)
+
+    def push_message(self, *args, **kwargs):
+        with tracer.span('line.push_message', kind='CLIENT'):
+            return super().push_message(*args, **kwargs)
+
 # LINE Bot 設定
-line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
+line_bot_api = TracedLineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
 handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+# 簽章驗證獨立成一個 span，和事件解析、處理的時間分開
+handler.parser.signature_validator.validate = tracer.traced('line.verify_signature')(
+    handler.parser.signature_validator.validate)
+
+# 儲存後端 - Google Sheets (GOOGLE_AUTH_MODE 選擇認證方式)，設定 SQLITE_PATH 時同時寫入本地副本
+sheets_handler = create_storage_backend()
+
+# 關閉協調器 - 收到 SIGTERM 時排空進行中的工作
+shutdown_coordinator = ShutdownCoordinator()
+shutdown_coordinator.set_row_flusher(sheets_handler.append_rows)
+shutdown_coordinator.register_flusher('traces', tracer.flush)
 
-# Google Sheets 處理器
-sheets_handler = GoogleSheetsHandler()
+# 儲存流量控制 - 每位使用者的速度限制，並以 deficit round robin 公平排程 Sheets / Drive 寫入
+rate_limiter = UserRateLimiter()
+save_scheduler = FairScheduler()
+# 影片、語音、檔案上傳可能持續數分鐘，使用獨立且數量較少的執行緒，不佔用文字與圖片的寫入執行緒
+media_scheduler = FairScheduler(workers=int(os.getenv('MEDIA_SAVE_WORKERS', '2')))
+# 排程成本：上傳比單純寫入 Sheets 佔用更多配額與時間
+TEXT_SAVE_COST = 1
+IMAGE_SAVE_COST = 3
+MEDIA_SAVE_COST = 10
+THROTTLED_REPLY = "您傳送的速度有點快，這則內容沒有儲存，請稍候再傳送 🙏"
 
-# 用戶狀態管理 - 追蹤誰在儲存模式中
-user_save_states = {}
+# /debug/profile 單次取樣上限，需短於 gunicorn 的 timeout
+PROFILE_MAX_SECONDS = 60
+
+# 圖片上傳執行器 - 平行上傳，同一使用者的資料列依訊息順序寫入
+upload_executor = OrderedUploadExecutor(
+    sheets_handler.append_rows, scheduler=save_scheduler, upload_cost=IMAGE_SAVE_COST)
+shutdown_coordinator.register_row_source(upload_executor.take_uploaded_rows)
+
+# 用戶狀態管理 - 追蹤誰在儲存模式中 (多個 worker 程序共用)
+user_save_states = UserSaveStates()
+
+# 啟動重建 - worker 啟動後在背景執行緒讀取一次原始紀錄，重建每日統計與搜尋索引 (完成前 /readyz 回傳 503)
+startup_rebuild = StartupRebuild(
+    lambda: (row for _, row in iter_sheet_rows(sheets_handler.service, sheets_handler.SPREADSHEET_ID)))
+
+# 每日統計 - 設定 SUMMARY_SHEET 時在該分頁維護每位使用者每天的文字/圖片數量
+if os.getenv('SUMMARY_SHEET'):
+    daily_summary = DailySummary(sheets_handler)
+
+    def enable_daily_summary(rebuilt):
+        # 重建之後只在儲存成功時遞增
+        if rebuilt:
+            sheets_handler.add_save_listener(daily_summary.record)
+            shutdown_coordinator.register_flusher('daily_summary', daily_summary.flush)
+        else:
+            logger.error("每日統計重建失敗，本次執行停用每日統計")
+
+    startup_rebuild.add_consumer('daily_summary', daily_summary.start_rebuild, enable_daily_summary)
+
+# 搜尋索引 - /search 在本地倒排索引中搜尋使用者自己儲存的文字訊息
+search_index = SearchIndex()
+
+def enable_search_index(rebuilt):
+    if not rebuilt:
+        logger.error("重建搜尋索引失敗，只能搜尋之後儲存的訊息")
+    sheets_handler.add_save_listener(search_index.record)
+
+if search_index.doc_count() == 0:
+    # 本地沒有資料 (例如新部署) 時從 Google Sheets 重建
+    startup_rebuild.add_consumer('search_index', search_index.start_rebuild, enable_search_index)
+else:
+    search_index.load()
+    sheets_handler.add_save_listener(search_index.record)
+shutdown_coordinator.register_flusher('search_index', search_index.save)
+SEARCH_RESULT_LIMIT = 5
+SEARCH_SNIPPET_LENGTH = 100
 
 @app.route("/callback", methods=['POST'])
 def callback():
-    # get X-Line-Signature header value
-    signature = request.headers['X-Line-Signature']
+    # 關閉中不再接受新的 webhook
+    if not shutdown_coordinator.accepting:
+        abort(503)
 
-    # get request body as text
-    body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
+    with tracer.span('POST /callback', kind='SERVER'):
+        # get X-Line-Signature header value
+        signature = request.headers['X-Line-Signature']
 
-    # handle webhook body
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        print("Invalid signature. Please check your channel access token/channel secret.")
-        abort(400)
+        # get request body as text
+        body = request.get_data(as_text=True)
+        app.logger.info("Request body: " + body)
+
+        # handle webhook body
+        try:
+            handler.handle(body, signature)
+        except InvalidSignatureError:
+            print("Invalid signature. Please check your channel access token/channel secret.")
+            abort(400)
+
+    return 'OK'
 
+@app.route("/healthz", methods=['GET'])
+def healthz():
+    """存活檢查：程序可以回應請求"""
     return 'OK'
 
+@app.route("/readyz", methods=['GET'])
+def readyz():
+    """就緒檢查：啟動重建完成前與關閉中的 worker 不接收流量"""
+    if not startup_rebuild.ready.is_set():
+        return 'rebuilding', 503
+    if not shutdown_coordinator.accepting:
+        return 'draining', 503
+    return 'OK'
+
+@app.route("/status", methods=['GET'])
+def status():
+    """服務狀態：各上游服務的斷路器狀態"""
+    return jsonify({
+        'accepting': shutdown_coordinator.accepting,
+        'circuit_breakers': sheets_handler.breaker_states(),
+    })
+
+@app.route("/debug/profile", methods=['GET'])
+def debug_profile():
+    """在這個 worker 上取樣 N 秒，回傳 collapsed stacks (可交給 flamegraph.pl / speedscope)
+
+    需要 Authorization: Bearer <ADMIN_TOKEN>；未設定 ADMIN_TOKEN 時停用。
+    """
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8')):
+        abort(403)
+
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), PROFILE_MAX_SECONDS)
+    interval = min(max(request.args.get('interval', 0.01, type=float), 0.001), 1.0)
+    try:
+        counts = sample_stacks(seconds, interval)
+    except ProfilerBusyError:
+        return 'profiler already running', 409
+    logger.info(f"Profiler 取樣 {seconds}s，共 {sum(counts.values())} 個 stack")
+    return Response(format_collapsed(counts), mimetype='text/plain')
+
+def format_search_reply(user_id, keywords):
+    """搜尋使用者自己的訊息，組成回覆文字"""
+    if not keywords:
+        return "請輸入要搜尋的關鍵字，例如：/search 會議 記錄"
+    total, docs = search_index.search(user_id, keywords, limit=SEARCH_RESULT_LIMIT)
+    if not docs:
+        return f"找不到包含「{keywords}」的訊息"
+    
+    lines = [f"找到 {total} 則包含「{keywords}」的訊息" + (f"，顯示最新 {len(docs)} 則：" if total > len(docs) else "：")]
+    for timestamp, content in docs:
+        snippet = content if len(content) <= SEARCH_SNIPPET_LENGTH else content[:SEARCH_SNIPPET_LENGTH] + "…"
+        lines.append(f"\n{timestamp}\n{snippet}")
+    return "\n".join(lines)
+
+def reply_throttled(event):
+    """回覆超過儲存速度限制的訊息"""
+    line_bot_api.reply_message(
+        event.reply_token,
+        TextSendMessage(text=THROTTLED_REPLY)
+    )
+
 @handler.add(MessageEvent, message=TextMessage)
+@tracer.traced()
 def handle_text_message(event):
     """處理文字訊息"""
     user_id = event.source.user_id
     text = event.message.text
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = format_timestamp()
     
     # 檢查是否為控制指令
     if text == '/save':
@@ -72,6 +230,15 @@ def handle_text_message(event):
         logger.info(f"User {user_id} ended save mode")
         return
     
+    elif text == '/search' or text.startswith('/search '):
+        # 搜尋不需要在儲存模式中，只會搜尋自己的訊息
+        reply_text = format_search_reply(user_id, text[len('/search'):].strip())
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text=reply_text)
+        )
+        return
+    
     # 檢查用戶是否在儲存模式中
     if not user_save_states.get(user_id, False):
         reply_text = "目前非儲存模式，請先輸入 /save 開始儲存"
@@ -81,9 +248,19 @@ def handle_text_message(event):
         )
         return
     
+    # 超過儲存速度限制時禮貌地拒絕，不佔用其他使用者的配額
+    if not rate_limiter.try_acquire(user_id):
+        reply_throttled(event)
+        return
+    
     # 儲存到Google Sheets (只在儲存模式中)
     try:
-        sheets_handler.save_message(user_id, text, 'text', timestamp)
+        with shutdown_coordinator.track(f"text message from {user_id}"):
+            save_scheduler.submit(
+                user_id,
+                lambda: sheets_handler.save_message(user_id, text, 'text', timestamp),
+                TEXT_SAVE_COST
+            ).result()
         logger.info(f"Text message saved: {text}")
         
         # 回覆訊息
@@ -100,11 +277,12 @@ def handle_text_message(event):
         )
 
 @handler.add(MessageEvent, message=ImageMessage)
+@tracer.traced()
 def handle_image_message(event):
     """處理圖片訊息"""
     user_id = event.source.user_id
     message_id = event.message.id
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timestamp = format_timestamp()
     
     # 檢查用戶是否在儲存模式中
     if not user_save_states.get(user_id, False):
@@ -115,34 +293,134 @@ def handle_image_message(event):
         )
         return
     
-    try:
-        # 取得圖片內容
-        message_content = line_bot_api.get_message_content(message_id)
-        image_data = message_content.content
-        
-        # 儲存圖片到Google Drive和Google Sheets
-        image_url = sheets_handler.save_image(user_id, image_data, message_id, timestamp)
-        
-        logger.info(f"Image message saved: {message_id}")
-        
-        # 回覆訊息
-        if image_url:
-            reply_text = f"已儲存圖片至Google Drive: {image_url}"
-        else:
-            reply_text = "圖片已儲存但上傳Google Drive時發生問題"
+    if not rate_limiter.try_acquire(user_id):
+        reply_throttled(event)
+        return
+    
+    def upload():
+        # 取得圖片內容並上傳到Google Drive (在上傳執行緒中執行)
+        with tracer.span('line.get_message_content', kind='CLIENT'):
+            message_content = line_bot_api.get_message_content(message_id)
+            image_data = message_content.content
+        image_info, image_url = sheets_handler.upload_image(image_data, message_id)
+        return SheetRow(timestamp, user_id, 'image', image_info, image_url), image_url
+    
+    def notify(future):
+        # 上傳和寫入 Google Sheets 可能超過 reply token 的有效期限，完成後以 push 通知結果
+        try:
+            image_url, committed = future.result()
+            logger.info(f"Image message saved: {message_id}")
+            
+            if image_url and committed:
+                reply_text = f"已儲存圖片至Google Drive: {image_url}"
+            else:
+                reply_text = "圖片已儲存但上傳Google Drive時發生問題"
+        except Exception as e:
+            logger.error(f"Error saving image message: {e}")
+            reply_text = "圖片儲存失敗，請稍後再試"
         
+        try:
+            line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+        except Exception as e:
+            logger.error(f"Error notifying {user_id} of image {message_id}: {e}")
+        finally:
+            shutdown_coordinator.finish(task_id)
+    
+    # 平行上傳，同一使用者的資料列仍依訊息順序寫入
+    task_id = shutdown_coordinator.start(f"image {message_id} from {user_id}")
+    upload_executor.submit(user_id, upload).add_done_callback(tracer.wrap(notify))
+    
+    # reply token 只使用這一次；失敗時只記錄，結果仍會以 push 通知
+    try:
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text="已收到圖片，上傳完成後會再通知您")
+        )
+    except Exception as e:
+        logger.error(f"Error replying to image message: {e}")
+
+MEDIA_TYPES = {
+    VideoMessage: ('video', 'video/mp4', '影片'),
+    AudioMessage: ('audio', 'audio/x-m4a', '語音'),
+    FileMessage: ('file', 'application/octet-stream', '檔案'),
+}
+
+@handler.add(MessageEvent, message=(VideoMessage, AudioMessage, FileMessage))
+@tracer.traced()
+def handle_media_message(event):
+    """處理影片、語音和檔案訊息 (串流上傳，不將整個檔案載入記憶體)
+
+    先回覆已收到，上傳在背景進行，完成後以 push 訊息通知結果。
+    """
+    user_id = event.source.user_id
+    message_id = event.message.id
+    timestamp = format_timestamp()
+    message_type, default_mimetype, label = MEDIA_TYPES[type(event.message)]
+    file_name = getattr(event.message, 'file_name', None)
+    
+    # 檢查用戶是否在儲存模式中
+    if not user_save_states.get(user_id, False):
+        reply_text = "目前非儲存模式，請先輸入 /save 開始儲存"
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text=reply_text)
         )
+        return
+    
+    if not rate_limiter.try_acquire(user_id):
+        reply_throttled(event)
+        return
+    
+    def save():
+        # 以串流方式取得內容 (內容在上傳時才讀取，下載時間包含在上傳的 span 中)
+        with tracer.span('line.get_message_content', kind='CLIENT'):
+            message_content = line_bot_api.get_message_content(message_id)
+        mimetype = message_content.content_type or default_mimetype
+        size = message_content.response.headers.get('content-length')
+        chunks = message_content.iter_content(chunk_size=256 * 1024)
+        
+        return sheets_handler.save_media(
+            user_id, chunks, message_id, message_type, mimetype, timestamp,
+            file_name=file_name, size=size
+        )
+    
+    def notify(future):
+        # 上傳可能超過 reply token 的有效期限，完成後以 push 通知結果
+        try:
+            media_url = future.result()
+            logger.info(f"{message_type} message saved: {message_id}")
+            
+            if media_url:
+                reply_text = f"已儲存{label}至Google Drive: {media_url}"
+            else:
+                reply_text = f"{label}上傳Google Drive時發生問題"
+        except Exception as e:
+            logger.error(f"Error saving {message_type} message: {e}")
+            reply_text = f"{label}儲存失敗，請稍後再試"
         
-    except Exception as e:
-        logger.error(f"Error saving image message: {e}")
+        try:
+            line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+        except Exception as e:
+            logger.error(f"Error notifying {user_id} of {message_type} {message_id}: {e}")
+        finally:
+            shutdown_coordinator.finish(task_id)
+    
+    # 在背景上傳，webhook 不等待上傳完成
+    task_id = shutdown_coordinator.start(f"{message_type} {message_id} from {user_id}")
+    media_scheduler.submit(user_id, save, MEDIA_SAVE_COST).add_done_callback(tracer.wrap(notify))
+    
+    # reply token 只使用這一次；失敗時只記錄，結果仍會以 push 通知
+    try:
         line_bot_api.reply_message(
             event.reply_token,
-            TextSendMessage(text="圖片儲存失敗，請稍後再試")
+            TextSendMessage(text=f"已收到{label}，上傳完成後會再通知您")
         )
+    except Exception as e:
+        logger.error(f"Error replying to {message_type} message: {e}")
 
 if __name__ == "__main__":
+    # 本地開發用；正式環境請使用 gunicorn -c gunicorn.conf.py app:app
     port = int(os.environ.get("PORT", 5000))
+    shutdown_coordinator.install_signal_handlers()
+    startup_rebuild.start()
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
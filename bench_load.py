@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Webhook 負載測試：以不同 worker 數啟動 gunicorn，量測 requests/sec 隨 CPU 核心數的變化
+傳送已簽章、events 為空的 webhook (與 LINE 驗證 webhook 時相同)，會經過簽章驗證與解析，
+但不會呼叫 LINE / Google API。需要與正式環境相同的環境變數 (.env)，因為 app 啟動時會初始化 Google client。
+"""
+
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import hashlib
+import argparse
+import subprocess
+import http.client
+import multiprocessing
+from dotenv import load_dotenv
+
+BODY = json.dumps({'destination': 'bench', 'events': []})
+
+
+def sign(body, channel_secret):
+    digest = hmac.new(channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def client_loop(args):
+    """單一負載產生程序：保持連線重複送出 webhook，回傳 (成功數, 失敗數)"""
+    port, signature, duration, connections = args
+    clients = [http.client.HTTPConnection('127.0.0.1', port, timeout=10) for _ in range(connections)]
+    headers = {'Content-Type': 'application/json', 'X-Line-Signature': signature}
+    ok = failed = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for i, client in enumerate(clients):
+            try:
+                client.request('POST', '/callback', body=BODY, headers=headers)
+                response = client.getresponse()
+                response.read()
+                if response.status == 200:
+                    ok += 1
+                else:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                client.close()
+                clients[i] = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    return ok, failed
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            client.request('GET', '/readyz')
+            if client.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run(workers, port, duration, clients, connections, signature):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(port),
+               LOG_LEVEL='warning', GUNICORN_ACCESS_LOG='')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            raise RuntimeError("gunicorn 沒有在時間內就緒，請確認環境變數與憑證")
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(client_loop, [(port, signature, duration, connections)] * clients)
+        ok = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        return ok / duration, failed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook 負載測試')
+    cores = multiprocessing.cpu_count()
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, max(1, cores // 2), cores}),
+                        help='要測試的 gunicorn worker 數')
+    parser.add_argument('--duration', type=float, default=10, help='每組測試秒數')
+    parser.add_argument('--clients', type=int, default=max(2, cores), help='負載產生程序數')
+    parser.add_argument('--connections', type=int, default=4, help='每個負載產生程序的連線數')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    load_dotenv()
+    channel_secret = os.getenv('LINE_CHANNEL_SECRET')
+    if not channel_secret:
+        print("❌ 錯誤：未設定 LINE_CHANNEL_SECRET 環境變數")
+        sys.exit(1)
+    signature = sign(BODY, channel_secret)
+
+    print(f"CPU 核心數: {cores}，每組 {args.duration:.0f}s，"
+          f"{args.clients} 個負載程序 × {args.connections} 連線")
+    baseline = None
+    for workers in args.workers:
+        rps, failed = run(workers, args.port, args.duration, args.clients, args.connections, signature)
+        baseline = baseline or rps
+        print(f"workers={workers:2d}: {rps:8.0f} req/s  ({rps / baseline:4.1f}x)  失敗 {failed}")
+
+
+if __name__ == "__main__":
+    main()
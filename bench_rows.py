@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+資料列建立與序列化的記憶體比較：舊的 list + dict body + json.dumps vs SheetRow + 直接序列化
+以 tracemalloc 量測持續儲存訊息時每則訊息佔用的記憶體、序列化時的峰值。
+不需要 Google API 憑證
+"""
+
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+from sheet_row import SheetRow, format_timestamp, format_file_timestamp, encode_json_body
+
+SAMPLE_TEXTS = [
+    "明天下午三點開會，記得帶報告",
+    "Meeting notes: budget review moved to Friday",
+    "已完成客戶拜訪，下週提供報價",
+]
+
+
+def legacy_message(index):
+    """舊的作法：每則訊息各自呼叫 strftime，資料列為 list"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    filename = f"linebot_image_{index}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+    return [timestamp, f"U{index % 50}", 'text', SAMPLE_TEXTS[index % 3], filename]
+
+
+def compact_message(index):
+    timestamp = format_timestamp()
+    filename = f"linebot_image_{index}_{format_file_timestamp()}.jpg"
+    return SheetRow(timestamp, f"U{index % 50}", 'text', SAMPLE_TEXTS[index % 3], filename)
+
+
+def legacy_body(rows):
+    # googleapiclient 的 JsonModel 以 json.dumps(body) 序列化，之後由 httplib2 再編碼成 bytes
+    return json.dumps({'values': rows}).encode('utf-8')
+
+
+def measure_rows(make_row, encode, messages, batch_size):
+    """持續建立資料列並保留 (模擬等待寫入的緩衝)，每 batch_size 則序列化一次"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    buffered = []
+    body_bytes = 0
+    for index in range(messages):
+        buffered.append(make_row(index))
+        if len(buffered) % batch_size == 0:
+            body_bytes += len(encode(buffered[-batch_size:]))
+    retained, peak = tracemalloc.get_traced_memory()
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+    del buffered
+    return retained / messages, peak, body_bytes / messages, elapsed / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='資料列記憶體配置比較')
+    parser.add_argument('--messages', type=int, default=50000, help='模擬儲存的訊息數')
+    parser.add_argument('--batch-size', type=int, default=100, help='每次批次寫入的列數')
+    args = parser.parse_args()
+
+    print(f"{args.messages} 則訊息，每 {args.batch_size} 列序列化一次")
+    print(f"{'':10s} {'每則保留':>10s} {'峰值':>10s} {'body/則':>9s} {'每則耗時':>9s}")
+    results = {}
+    for name, make_row, encode in [
+        ('legacy', legacy_message, legacy_body),
+        ('compact', compact_message, encode_json_body),
+    ]:
+        per_row, peak, body, micros = measure_rows(make_row, encode, args.messages, args.batch_size)
+        results[name] = per_row
+        print(f"{name:10s} {per_row:8.0f} B {peak / 1024:7.0f} KB {body:7.0f} B {micros:7.2f} µs")
+    print(f"每則訊息保留的記憶體減少 {1 - results['compact'] / results['legacy']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
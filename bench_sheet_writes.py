@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+寫入延遲比較：values().append (表格偵測) vs 本地游標 + values().batchUpdate
+會實際寫入指定的試算表，請使用測試用的試算表 (表格越大，差異越明顯)
+"""
+
+import os
+import time
+import argparse
+import statistics
+from dotenv import load_dotenv
+from export_sheet import create_sheets_handler
+from sheet_cursor import CursorRowWriter
+
+
+def measure(label, write, writes, rows_per_write):
+    latencies = []
+    for i in range(writes):
+        rows = [[f"bench {label} {i}", 'bench_user', 'text', f"row {j}", ''] for j in range(rows_per_write)]
+        started = time.perf_counter()
+        write(rows)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:8s}: 平均 {statistics.mean(latencies):7.1f}ms  "
+          f"p50 {statistics.median(latencies):7.1f}ms  p95 {p95:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Google Sheets 寫入延遲比較')
+    parser.add_argument('--spreadsheet-id', required=True, help='測試用試算表 ID (會寫入資料)')
+    parser.add_argument('--writes', type=int, default=30)
+    parser.add_argument('--rows-per-write', type=int, default=1)
+    parser.add_argument('--auth', choices=['oauth', 'service-account'], default='oauth')
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ['GOOGLE_SPREADSHEET_ID'] = args.spreadsheet_id
+    os.environ['SHEETS_WRITE_MODE'] = 'append'
+    sheets_handler = create_sheets_handler(args.auth)
+
+    cursor_writer = CursorRowWriter(sheets_handler)
+    started = time.perf_counter()
+    next_row = cursor_writer.sync()
+    print(f"目前資料列數: {next_row - 1}，游標同步耗時 {(time.perf_counter() - started) * 1000:.1f}ms (只在啟動時執行)")
+
+    measure('append', sheets_handler.append_rows, args.writes, args.rows_per_write)
+    # append 之後重新同步，讓游標接在 append 寫入的資料之後
+    cursor_writer.sync()
+    measure('cursor', cursor_writer.write_rows, args.writes, args.rows_per_write)
+
+
+if __name__ == "__main__":
+    main()
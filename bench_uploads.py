@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+相簿上傳效能比較：目前的逐張上傳 vs OrderedUploadExecutor 平行上傳
+以模擬延遲取代 Drive 上傳，不需要 Google API 憑證
+"""
+
+import time
+import random
+import argparse
+from upload_executor import OrderedUploadExecutor
+
+
+def simulated_upload(user_id, index, latency, jitter):
+    def upload():
+        time.sleep(latency + random.uniform(0, jitter))
+        return [f"t{index}", user_id, 'image', f"photo {index}", f"https://drive/{index}"], index
+    return upload
+
+
+def run_serial(users, album_size, latency, jitter, append_latency):
+    committed = []
+    started = time.monotonic()
+    for user_id in users:
+        for index in range(album_size):
+            row, _ = simulated_upload(user_id, index, latency, jitter)()
+            time.sleep(append_latency)
+            committed.append(row)
+    return time.monotonic() - started, committed
+
+
+def run_parallel(users, album_size, latency, jitter, append_latency, workers):
+    committed = []
+
+    def commit_rows(rows):
+        time.sleep(append_latency)
+        committed.extend(rows)
+        return True
+
+    executor = OrderedUploadExecutor(commit_rows, max_workers=workers)
+    started = time.monotonic()
+    futures = []
+    for index in range(album_size):
+        for user_id in users:
+            futures.append(executor.submit(user_id, simulated_upload(user_id, index, latency, jitter)))
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - started
+    executor.shutdown()
+    return elapsed, committed
+
+
+def check_order(committed, users):
+    for user_id in users:
+        indexes = [int(row[3].split()[1]) for row in committed if row[1] == user_id]
+        if indexes != sorted(indexes):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='相簿上傳效能比較')
+    parser.add_argument('--album-size', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.4, help='每張圖片的模擬上傳秒數')
+    parser.add_argument('--jitter', type=float, default=0.3, help='上傳延遲的隨機變動秒數')
+    parser.add_argument('--append-latency', type=float, default=0.15, help='每次 Sheets append 的模擬秒數')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+
+    users = [f"user{i}" for i in range(args.users)]
+    total = args.album_size * len(users)
+
+    serial_time, _ = run_serial(users, args.album_size, args.latency, args.jitter, args.append_latency)
+    print(f"逐張上傳           : {serial_time:6.2f}s  ({total / serial_time:5.1f} images/sec)")
+
+    for workers in args.workers:
+        elapsed, committed = run_parallel(
+            users, args.album_size, args.latency, args.jitter, args.append_latency, workers)
+        ordered = '✅' if check_order(committed, users) and len(committed) == total else '❌'
+        print(f"平行上傳 ({workers:2d} workers): {elapsed:6.2f}s  ({total / elapsed:5.1f} images/sec)  "
+              f"{serial_time / elapsed:4.1f}x  順序 {ordered}")
+
+
+if __name__ == "__main__":
+    main()
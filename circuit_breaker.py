@@ -0,0 +1,139 @@
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，請求未送出"""
+
+
+def _describe_error(error):
+    """/status 顯示的錯誤摘要
+
+    例外只保留類別名稱 (與 HTTP 狀態碼)：例外訊息可能包含請求 URL，
+    例如 ImgBB 的 API key 在 query string 中，不能從未驗證的 /status 洩漏。
+    """
+    if error is None or isinstance(error, str):
+        return error
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return f"{type(error).__name__} {status}" if status is not None else type(error).__name__
+
+
+class CircuitBreaker:
+    """上游服務的斷路器
+
+    closed: 正常送出請求，連續失敗達 failure_threshold 次後開啟。
+    open: 直接略過請求，經過 reset_timeout 秒後進入 half_open。
+    half_open: 只放行一個探測請求 (有設定 probe 時先以 probe 探測)，成功則關閉，失敗則再次開啟。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, probe=None,
+                 clock=time.monotonic):
+        if failure_threshold is None:
+            failure_threshold = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3'))
+        if reset_timeout is None:
+            reset_timeout = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '300'))
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._open_for = reset_timeout
+        self._probe_in_flight = False
+        self._last_error = None
+        self._skipped = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self._open_for:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info(f"斷路器 {self.name} 進入 half_open，準備探測")
+
+    def allow_request(self):
+        """是否可以送出請求；half_open 時只放行一個探測請求"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                run_probe = self.probe is not None
+            else:
+                self._skipped += 1
+                return False
+
+        if not run_probe:
+            # 由這次的實際請求當作探測
+            return True
+
+        try:
+            healthy = self.probe()
+        except Exception as e:
+            logger.warning(f"斷路器 {self.name} 探測失敗: {e}")
+            healthy = False
+        if healthy:
+            self.record_success()
+            return True
+        self.record_failure('probe failed')
+        with self._lock:
+            self._skipped += 1
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"斷路器 {self.name} 恢復 closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error=None, open_for=None):
+        """記錄一次失敗；open_for 可指定這次開啟的秒數 (例如配額用盡時開啟較久)
+
+        error 為字串時原樣保留，為例外時只保留類別名稱，完整訊息由呼叫端記錄在 log。
+        """
+        with self._lock:
+            self._failures += 1
+            self._last_error = _describe_error(error)
+            self._probe_in_flight = False
+            if (self._state == self.HALF_OPEN or open_for is not None
+                    or self._failures >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    logger.warning(f"斷路器 {self.name} 開啟: {self._last_error}")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._open_for = open_for if open_for is not None else self.reset_timeout
+
+    def snapshot(self):
+        """目前狀態，用於 /status"""
+        with self._lock:
+            self._maybe_half_open()
+            retry_in = None
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self._open_for - (self._clock() - self._opened_at))
+            return {
+                'state': self._state,
+                'failures': self._failures,
+                'retry_in': retry_in,
+                'skipped_requests': self._skipped,
+                'last_error': self._last_error,
+            }
@@ -0,0 +1,314 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from collections import Counter
+from export_sheet import iter_sheet_rows
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADERS = ['日期', '使用者ID', '文字', '圖片']
+COUNTED_TYPES = ('text', 'image')
+DEFAULT_GRID_GROWTH = 1000
+
+
+class DailySummary:
+    """每位使用者每天的文字/圖片數量，維護在獨立的摘要分頁
+
+    儲存成功時由後端的 listener 遞增計數，背景執行緒每 flush_interval 秒
+    把有變動的列以一次 values().batchUpdate 寫入摘要分頁，報表不需要再掃描原始紀錄。
+    啟動時 rebuild() 從原始紀錄重建一次。
+
+    計數放在 SQLite 而不是程序記憶體中：gunicorn 的多個 worker 都會寫入，
+    需要共用同一份計數。同一時間只有持有租約的 worker 會寫入分頁。
+    寫入時依 (日期, 使用者ID) 讀取分頁中目前的列位置，不快取列號：
+    其他容器重建分頁後列的順序可能改變，依舊的列號寫入會覆蓋別人的統計。
+    """
+
+    def __init__(self, backend, sheet_title=None, path=None, flush_interval=None):
+        if flush_interval is None:
+            flush_interval = float(os.getenv('SUMMARY_FLUSH_INTERVAL', '60'))
+        self.backend = backend
+        self.sheet_title = sheet_title or os.getenv('SUMMARY_SHEET', '每日統計')
+        self.path = path or os.getenv('SUMMARY_DB_PATH', 'daily_summary.db')
+        self.flush_interval = flush_interval
+        self.lease_timeout = flush_interval * 3
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sheet_id = None
+        self._row_count = None
+        self._pid = None
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS daily_counts ('
+                ' date TEXT NOT NULL,'
+                ' user_id TEXT NOT NULL,'
+                ' texts INTEGER NOT NULL DEFAULT 0,'
+                ' images INTEGER NOT NULL DEFAULT 0,'
+                ' dirty INTEGER NOT NULL DEFAULT 1,'
+                ' version INTEGER NOT NULL DEFAULT 0,'
+                ' PRIMARY KEY (date, user_id))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS summary_lease ('
+                ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+                ' owner INTEGER NOT NULL,'
+                ' expires REAL NOT NULL)'
+            )
+
+    def _connection(self):
+        # 每個執行緒各自的連線；fork 後的 worker 重新建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _range(self, a1):
+        title = self.sheet_title.replace("'", "''")
+        return f"'{title}'!{a1}"
+
+    def record(self, rows):
+        """儲存成功的 listener：依資料列的日期、使用者與類型遞增計數"""
+        increments = Counter()
+        for row in rows:
+            if row[2] in COUNTED_TYPES:
+                increments[(str(row[0])[:10], row[1], row[2])] += 1
+        if not increments:
+            return
+
+        conn = self._connection()
+        with conn:
+            for (date, user_id, message_type), count in increments.items():
+                texts = count if message_type == 'text' else 0
+                images = count if message_type == 'image' else 0
+                conn.execute(
+                    'INSERT INTO daily_counts (date, user_id, texts, images) VALUES (?, ?, ?, ?)'
+                    ' ON CONFLICT(date, user_id) DO UPDATE SET'
+                    ' texts = texts + excluded.texts, images = images + excluded.images,'
+                    ' dirty = 1, version = version + 1',
+                    (date, user_id, texts, images)
+                )
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # 背景 flush 執行緒在第一次記錄時才建立，gunicorn fork 後的 worker 需要重新建立
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='daily-summary', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"每日統計寫入失敗: {e}")
+
+    def _acquire_lease(self):
+        """取得 (或續約) 寫入摘要分頁的租約，避免多個 worker 以舊的數值互相覆蓋"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO summary_lease (id, owner, expires) VALUES (1, ?, ?)'
+                ' ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires'
+                ' WHERE summary_lease.owner = excluded.owner OR summary_lease.expires < ?',
+                (os.getpid(), now + self.lease_timeout, now)
+            )
+        return cursor.rowcount == 1
+
+    def _ensure_sheet(self, last_row):
+        """確保摘要分頁存在且列數足夠"""
+        spreadsheets = self.backend.service.spreadsheets()
+        if self._sheet_id is None:
+            spreadsheet = spreadsheets.get(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                fields='sheets.properties(sheetId,title,gridProperties.rowCount)'
+            ).execute()
+            for sheet in spreadsheet.get('sheets', []):
+                properties = sheet['properties']
+                if properties['title'] == self.sheet_title:
+                    self._sheet_id = properties['sheetId']
+                    self._row_count = properties['gridProperties']['rowCount']
+                    break
+            else:
+                result = spreadsheets.batchUpdate(
+                    spreadsheetId=self.backend.SPREADSHEET_ID,
+                    body={'requests': [{'addSheet': {'properties': {
+                        'title': self.sheet_title,
+                        'gridProperties': {
+                            'rowCount': max(last_row, DEFAULT_GRID_GROWTH),
+                            'columnCount': len(SUMMARY_HEADERS),
+                        },
+                    }}}]}
+                ).execute()
+                properties = result['replies'][0]['addSheet']['properties']
+                self._sheet_id = properties['sheetId']
+                self._row_count = properties['gridProperties']['rowCount']
+                logger.info(f"已建立摘要分頁: {self.sheet_title}")
+
+        if last_row > self._row_count:
+            length = max(last_row - self._row_count, DEFAULT_GRID_GROWTH)
+            spreadsheets.batchUpdate(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                body={'requests': [{'appendDimension': {
+                    'sheetId': self._sheet_id,
+                    'dimension': 'ROWS',
+                    'length': length
+                }}]}
+            ).execute()
+            self._row_count += length
+
+    def start_rebuild(self):
+        """開始重建：回傳逐列接收原始紀錄的 SummaryRebuild，可和其他重建共用同一次讀取"""
+        return SummaryRebuild(self)
+
+    def rebuild(self):
+        """從原始紀錄重建所有計數並重寫摘要分頁，成功回傳 True"""
+        rebuild = self.start_rebuild()
+        try:
+            for _, row in iter_sheet_rows(self.backend.service, self.backend.SPREADSHEET_ID):
+                rebuild.add(row)
+        except Exception as e:
+            logger.error(f"重建每日統計失敗: {e}")
+            return False
+        return rebuild.finish()
+
+    def _write_rebuild(self, counts, scanned, started):
+        """以重新計算的計數重寫摘要分頁與 SQLite，成功回傳 True"""
+        values = [SUMMARY_HEADERS] + [
+            [date, user_id, texts, images]
+            for (date, user_id), (texts, images) in sorted(counts.items())
+        ]
+        try:
+            # 重新讀取分頁屬性，列數可能已被其他寫入 (append) 改變
+            self._sheet_id = None
+            self._ensure_sheet(len(values))
+            self.backend.service.spreadsheets().values().clear(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                range=self._range('A:D')
+            ).execute()
+            self.backend.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                body={
+                    'valueInputOption': 'RAW',
+                    'data': [{'range': self._range(f"A1:D{len(values)}"), 'values': values}]
+                }
+            ).execute()
+        except Exception as e:
+            logger.error(f"重建每日統計失敗: {e}")
+            return False
+
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM daily_counts')
+            conn.executemany(
+                'INSERT INTO daily_counts (date, user_id, texts, images, dirty) VALUES (?, ?, ?, ?, 0)',
+                values[1:]
+            )
+        logger.info(
+            f"每日統計重建完成: 掃描 {scanned} 列，{len(values) - 1} 筆統計，"
+            f"耗時 {time.monotonic() - started:.1f}s"
+        )
+        return True
+
+    def _sheet_rows(self):
+        """讀取摘要分頁目前的 (日期, 使用者ID) -> 列號"""
+        result = self.backend.service.spreadsheets().values().get(
+            spreadsheetId=self.backend.SPREADSHEET_ID,
+            range=self._range('A:B')
+        ).execute()
+        rows = {}
+        for row, value in enumerate(result.get('values', []), start=1):
+            if len(value) == 2:
+                rows.setdefault((value[0], value[1]), row)
+        return rows
+
+    def flush(self):
+        """把有變動的統計寫入摘要分頁：已存在的列以一次批次更新覆寫，新的列附加在最後"""
+        if not self._acquire_lease():
+            return False
+
+        conn = self._connection()
+        pending = conn.execute(
+            'SELECT date, user_id, texts, images, version FROM daily_counts'
+            ' WHERE dirty = 1 ORDER BY date, user_id'
+        ).fetchall()
+        if not pending:
+            return True
+
+        self._ensure_sheet(1)
+        sheet_rows = self._sheet_rows()
+        updates = sorted(
+            (sheet_rows[(date, user_id)], [date, user_id, texts, images])
+            for date, user_id, texts, images, _ in pending if (date, user_id) in sheet_rows
+        )
+        new_rows = [
+            [date, user_id, texts, images]
+            for date, user_id, texts, images, _ in pending if (date, user_id) not in sheet_rows
+        ]
+
+        if updates:
+            # 相鄰的列合併成同一個範圍，減少 request 大小
+            data = []
+            for row, values in updates:
+                if data and data[-1]['last'] == row - 1:
+                    data[-1]['last'] = row
+                    data[-1]['values'].append(values)
+                else:
+                    data.append({'first': row, 'last': row, 'values': [values]})
+            self.backend.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                body={
+                    'valueInputOption': 'RAW',
+                    'data': [
+                        {'range': self._range(f"A{block['first']}:D{block['last']}"), 'values': block['values']}
+                        for block in data
+                    ]
+                }
+            ).execute()
+        if new_rows:
+            self.backend.service.spreadsheets().values().append(
+                spreadsheetId=self.backend.SPREADSHEET_ID,
+                range=self._range('A:D'),
+                valueInputOption='RAW',
+                insertDataOption='INSERT_ROWS',
+                body={'values': new_rows}
+            ).execute()
+
+        # 寫入期間又被更新的列保持 dirty，下次再寫
+        with conn:
+            conn.executemany(
+                'UPDATE daily_counts SET dirty = 0 WHERE date = ? AND user_id = ? AND version = ?',
+                [(date, user_id, version) for date, user_id, _, _, version in pending]
+            )
+        logger.info(f"每日統計已更新 {len(updates)} 列，新增 {len(new_rows)} 列")
+        return True
+
+
+class SummaryRebuild:
+    """由 DailySummary.start_rebuild() 建立：add() 逐列計數，finish() 寫入摘要分頁，成功回傳 True"""
+
+    def __init__(self, summary):
+        self.summary = summary
+        self.counts = {}
+        self.scanned = 0
+        self.started = time.monotonic()
+
+    def add(self, row):
+        self.scanned += 1
+        if row[2] not in COUNTED_TYPES:
+            return
+        totals = self.counts.setdefault((str(row[0])[:10], row[1]), [0, 0])
+        totals[COUNTED_TYPES.index(row[2])] += 1
+
+    def finish(self):
+        return self.summary._write_rebuild(self.counts, self.scanned, self.started)
@@ -0,0 +1,169 @@
+import os
+import time
+import tempfile
+import logging
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUpload, MediaIoBaseUpload
+from tracing import tracer
+from sheet_row import format_file_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Drive resumable upload 的 chunk 大小必須是 256KB 的倍數
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE_MB = 8
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+MEDIA_EXTENSIONS = {
+    'video': 'mp4',
+    'audio': 'm4a',
+}
+MEDIA_LABELS = {
+    'video': '影片',
+    'audio': '語音',
+    'file': '檔案',
+}
+
+
+def get_chunk_size():
+    """從 DRIVE_UPLOAD_CHUNK_MB 環境變數讀取 chunk 大小，並對齊 256KB"""
+    chunk_mb = float(os.getenv('DRIVE_UPLOAD_CHUNK_MB', DEFAULT_CHUNK_SIZE_MB))
+    chunks = max(1, int(chunk_mb * 1024 * 1024) // CHUNK_ALIGNMENT)
+    return chunks * CHUNK_ALIGNMENT
+
+
+def build_media_filename(message_id, message_type, file_name=None):
+    """產生 Drive 上的檔案名稱"""
+    timestamp = format_file_timestamp()
+    if file_name:
+        return f"linebot_{message_type}_{message_id}_{timestamp}_{file_name}"
+    extension = MEDIA_EXTENSIONS.get(message_type, 'bin')
+    return f"linebot_{message_type}_{message_id}_{timestamp}.{extension}"
+
+
+def describe_media(message_type, size, file_name=None):
+    """產生 Google Sheets 內容欄位的描述"""
+    label = MEDIA_LABELS.get(message_type, message_type)
+    if file_name:
+        return f"{label}: {file_name} ({size} bytes)"
+    return f"{label}大小: {size} bytes"
+
+
+class SourceStreamError(Exception):
+    """來源串流 (例如 LINE 內容下載) 中斷或提早結束；無法續傳，整個上傳需放棄
+
+    刻意不繼承 OSError：upload_stream_to_drive 只對 Drive 連線錯誤重試，
+    來源已中斷時重試只會把截斷的檔案當成完整檔案上傳。
+    """
+
+
+class StreamingMediaUpload(MediaUpload):
+    """把只能往前讀的串流包成 resumable upload，記憶體中最多只保留一個 chunk"""
+
+    def __init__(self, chunks, mimetype, size, chunksize):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._mimetype = mimetype
+        self._size = size
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._exhausted = False
+        self._error = None
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        if begin < self._buffer_start:
+            # 伺服器已確認的位置早於目前保留的 chunk，串流無法倒回
+            raise ValueError(
+                f"無法從位置 {begin} 續傳，串流只保留 {self._buffer_start} 之後的資料")
+
+        # 伺服器已確認的資料不需要再保留
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+
+        if self._error is not None:
+            raise self._error
+        while len(self._buffer) < length and not self._exhausted:
+            try:
+                self._buffer.extend(next(self._chunks))
+            except StopIteration:
+                self._exhausted = True
+            except Exception as e:
+                # 產生器拋出例外後就無法再讀取，之後的呼叫也要失敗，不能當成串流結束
+                self._error = SourceStreamError(f"讀取來源串流失敗 (位置 {self._buffer_start + len(self._buffer)}): {e}")
+                raise self._error from e
+
+        received = self._buffer_start + len(self._buffer)
+        if self._exhausted and received < self._size:
+            # googleapiclient 會把不足的讀取當成檔案結尾並完成上傳
+            self._error = SourceStreamError(f"來源串流只有 {received} bytes，預期 {self._size} bytes")
+            raise self._error
+
+        return bytes(self._buffer[:length])
+
+
+def create_media_upload(chunks, mimetype, size=None, chunksize=None):
+    """建立 resumable 上傳物件；已知大小時直接串流，否則先暫存 (超過一個 chunk 才寫入磁碟)"""
+    chunksize = chunksize or get_chunk_size()
+    if size is not None:
+        return StreamingMediaUpload(chunks, mimetype, int(size), chunksize)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=chunksize)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return MediaIoBaseUpload(spool, mimetype=mimetype, chunksize=chunksize, resumable=True)
+
+
+@tracer.traced('drive.files.create', kind='CLIENT')
+def upload_stream_to_drive(drive_service, file_metadata, media, fields='id', max_failures=5):
+    """以 resumable upload 分段上傳，Drive 連線中斷時從最後一個已確認的 chunk 續傳
+
+    只重試 Drive 的錯誤；來源串流的錯誤 (SourceStreamError) 直接往外拋並放棄上傳。
+    """
+    request = drive_service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields=fields
+    )
+
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            status, response = request.next_chunk(num_retries=2)
+            failures = 0
+            if status:
+                logger.info(f"{file_metadata.get('name')} 上傳進度: {status.resumable_progress} bytes")
+        except HttpError as error:
+            if error.resp.status not in RETRYABLE_STATUS:
+                raise
+            failures += 1
+            if failures > max_failures:
+                raise
+            logger.warning(f"上傳中斷 ({error.resp.status})，{2 ** failures}s 後從已確認的 chunk 續傳")
+            time.sleep(2 ** failures)
+        except (OSError, httplib2.HttpLib2Error) as error:
+            failures += 1
+            if failures > max_failures:
+                raise
+            logger.warning(f"上傳連線中斷 ({error})，{2 ** failures}s 後從已確認的 chunk 續傳")
+            time.sleep(2 ** failures)
+
+    return response
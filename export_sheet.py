@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+匯出 Google Sheets 訊息紀錄為 CSV / Parquet
+以固定大小的範圍分段讀取 (values().batchGet)，逐段串流寫出，不會把整張表載入記憶體
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import logging
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['時間戳記', '使用者ID', '訊息類型', '內容', '額外資訊']
+DEFAULT_CHUNK_ROWS = 5000
+DEFAULT_RANGES_PER_CALL = 4
+DEFAULT_CURSOR_FILE = 'export_cursor.json'
+
+
+def iter_sheet_rows(service, spreadsheet_id, start_row=2,
+                    chunk_rows=DEFAULT_CHUNK_ROWS, ranges_per_call=DEFAULT_RANGES_PER_CALL):
+    """從 start_row 開始分段讀取 A:E 資料，逐列產生 (列號, [5 個欄位])"""
+    row_number = start_row
+    while True:
+        firsts = [row_number + i * chunk_rows for i in range(ranges_per_call)]
+        ranges = [f"A{first}:E{first + chunk_rows - 1}" for first in firsts]
+
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            majorDimension='ROWS',
+            valueRenderOption='UNFORMATTED_VALUE'
+        ).execute()
+
+        found = False
+        for first, value_range in zip(firsts, result.get('valueRanges', [])):
+            # 列號依範圍起點計算：Sheets 會省略範圍尾端的空白列，不滿的區段不代表已經到底
+            for offset, row in enumerate(value_range.get('values', [])):
+                found = True
+                # 補齊空白欄位，讓每列都是固定 5 欄
+                yield first + offset, (list(row) + [''] * len(COLUMNS))[:len(COLUMNS)]
+
+        # 整批範圍都沒有資料才視為到底
+        if not found:
+            return
+        row_number += ranges_per_call * chunk_rows
+
+
+class CsvRowWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetRowWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("輸出 Parquet 需要安裝 pyarrow：pip install pyarrow")
+
+        self._pa = pa
+        self._schema = pa.schema([(name, pa.string()) for name in COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        columns = [[str(row[i]) for row in rows] for i in range(len(COLUMNS))]
+        table = self._pa.Table.from_arrays(columns, schema=self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+def load_cursor(cursor_file, spreadsheet_id):
+    """讀取上次匯出的下一列位置"""
+    if not os.path.exists(cursor_file):
+        return None
+    with open(cursor_file, 'r', encoding='utf-8') as f:
+        cursor = json.load(f)
+    if cursor.get('spreadsheet_id') != spreadsheet_id:
+        logger.warning("匯出游標屬於其他試算表，將從頭匯出")
+        return None
+    return cursor.get('next_row')
+
+
+def save_cursor(cursor_file, spreadsheet_id, next_row):
+    tmp_file = cursor_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'spreadsheet_id': spreadsheet_id, 'next_row': next_row}, f)
+    os.replace(tmp_file, cursor_file)
+
+
+def create_sheets_handler(auth):
+    """依認證方式建立現有的 Google Sheets 處理器"""
+    if auth == 'service-account':
+        from google_sheets import GoogleSheetsHandler
+        return GoogleSheetsHandler()
+    from google_sheets_oauth import GoogleSheetsOAuthHandler
+    return GoogleSheetsOAuthHandler()
+
+
+def export_sheet(sheets_handler, output, output_format='csv', start_row=2,
+                 chunk_rows=DEFAULT_CHUNK_ROWS, ranges_per_call=DEFAULT_RANGES_PER_CALL,
+                 write_batch=1000):
+    """串流匯出資料，回傳 (匯出列數, 下一次開始的列號, 耗時秒數)"""
+    writer = ParquetRowWriter(output) if output_format == 'parquet' else CsvRowWriter(output)
+    next_row = start_row
+    exported = 0
+    started = time.monotonic()
+    batch = []
+    try:
+        for row_number, row in iter_sheet_rows(
+                sheets_handler.service, sheets_handler.SPREADSHEET_ID,
+                start_row, chunk_rows, ranges_per_call):
+            batch.append(row)
+            next_row = row_number + 1
+            if len(batch) >= write_batch:
+                writer.write_rows(batch)
+                exported += len(batch)
+                batch = []
+                elapsed = time.monotonic() - started
+                logger.info(f"已匯出 {exported} 列 ({exported / elapsed:.0f} rows/sec)")
+        writer.write_rows(batch)
+        exported += len(batch)
+    finally:
+        writer.close()
+    return exported, next_row, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='匯出 Google Sheets 訊息紀錄')
+    parser.add_argument('output', help='輸出檔案路徑 (.csv 或 .parquet)')
+    parser.add_argument('--format', choices=['csv', 'parquet'],
+                        help='輸出格式，預設依副檔名判斷')
+    parser.add_argument('--since-last', action='store_true',
+                        help='只匯出上次匯出之後新增的資料列')
+    parser.add_argument('--cursor-file', default=DEFAULT_CURSOR_FILE,
+                        help=f'匯出游標檔案 (預設: {DEFAULT_CURSOR_FILE})')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f'每個讀取範圍的列數 (預設: {DEFAULT_CHUNK_ROWS})')
+    parser.add_argument('--ranges-per-call', type=int, default=DEFAULT_RANGES_PER_CALL,
+                        help=f'每次 batchGet 讀取的範圍數 (預設: {DEFAULT_RANGES_PER_CALL})')
+    parser.add_argument('--auth', choices=['oauth', 'service-account'], default='oauth',
+                        help='Google API 認證方式 (預設: oauth)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+
+    try:
+        sheets_handler = create_sheets_handler(args.auth)
+        spreadsheet_id = sheets_handler.SPREADSHEET_ID
+
+        start_row = 2  # 第 1 列為表頭
+        if args.since_last:
+            start_row = load_cursor(args.cursor_file, spreadsheet_id) or start_row
+            print(f"從第 {start_row} 列開始增量匯出")
+
+        exported, next_row, elapsed = export_sheet(
+            sheets_handler, args.output, output_format, start_row,
+            args.chunk_rows, args.ranges_per_call)
+
+        save_cursor(args.cursor_file, spreadsheet_id, next_row)
+
+        rate = exported / elapsed if elapsed > 0 else 0
+        print(f"✅ 匯出完成：{exported} 列 → {args.output}")
+        print(f"耗時 {elapsed:.2f}s，{rate:.0f} rows/sec")
+    except Exception as e:
+        print(f"❌ 匯出失敗：{e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import os
+import time
+import sqlite3
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """權杖桶：每秒補充 rate 個權杖，最多累積 capacity 個"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def try_acquire(self, cost, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+
+class UserRateLimiter:
+    """每個使用者一個權杖桶，限制儲存速度
+
+    權杖桶存在 SQLite 檔案中，讓 gunicorn 的多個 worker 程序共用同一份限制
+    (同一位使用者的訊息可能由不同 worker 處理，各自計算會讓實際上限乘上 worker 數)。
+    """
+
+    def __init__(self, rate_per_minute=None, burst=None, path=None, clock=time.time):
+        if rate_per_minute is None:
+            rate_per_minute = float(os.getenv('SAVE_RATE_PER_MINUTE', '30'))
+        if burst is None:
+            burst = float(os.getenv('SAVE_BURST', '20'))
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.path = path or os.getenv('RATE_LIMIT_PATH', 'rate_limits.db')
+        # 多個程序共用時間基準，所以使用牆上時間而非各程序的 monotonic
+        self._clock = clock
+        self._local = threading.local()
+        self._last_cleanup = clock()
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_buckets ('
+                ' user_id TEXT PRIMARY KEY,'
+                ' tokens REAL NOT NULL,'
+                ' updated REAL NOT NULL)'
+            )
+
+    def _connection(self):
+        # 每個執行緒各自的連線；fork 後的 worker 重新建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # 自行以 BEGIN IMMEDIATE 控制交易，讀取與扣除權杖之間不會被其他 worker 插入
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def try_acquire(self, user_id, cost=1):
+        """有足夠權杖時扣除並回傳 True，否則回傳 False (不等待)"""
+        now = self._clock()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated FROM rate_buckets WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            bucket = TokenBucket(self.rate, self.burst, now)
+            if row is not None:
+                bucket.tokens, bucket.updated = row
+            allowed = bucket.try_acquire(cost, now)
+            conn.execute(
+                'INSERT INTO rate_buckets (user_id, tokens, updated) VALUES (?, ?, ?)'
+                ' ON CONFLICT(user_id) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (user_id, bucket.tokens, bucket.updated)
+            )
+            self._cleanup(conn, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if not allowed:
+            logger.warning(f"User {user_id} 超過儲存速度限制")
+        return allowed
+
+    def _cleanup(self, conn, now):
+        # 權杖已補滿的桶等同新建，定期移除以免使用者數量無限成長
+        if now - self._last_cleanup < 60 or self.rate <= 0:
+            return
+        conn.execute('DELETE FROM rate_buckets WHERE updated <= ?', (now - self.burst / self.rate,))
+        self._last_cleanup = now
+
+
+class FairScheduler:
+    """以 deficit round robin 在使用者之間公平分配 Sheets / Drive 寫入
+
+    每個使用者一個佇列，工作執行緒輪流服務有工作的使用者；
+    每輪使用者獲得 quantum 的額度，工作的 cost 超過累積額度時換下一位，
+    因此大量傳送的使用者只會佔用自己的份額，不會讓其他人排在後面。
+    """
+
+    def __init__(self, workers=None, quantum=1):
+        if workers is None:
+            workers = int(os.getenv('SAVE_WORKERS', '4'))
+        self.workers = workers
+        self.quantum = quantum
+        self._cond = threading.Condition()
+        self._queues = {}  # user_id -> deque[(cost, fn, future, context)]
+        self._active = deque()  # 有工作等待的使用者，輪流服務
+        self._deficits = {}
+        self._running = 0
+        self._shutdown = False
+        self._threads = []
+        self._pid = None
+
+    def _ensure_started(self):
+        # 呼叫時需持有 self._cond；執行緒在第一次提交時才建立，
+        # gunicorn preload 後 fork 出的 worker 不會繼承父程序的執行緒，需要重新建立
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"fair-scheduler-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, user_id, fn, cost=1):
+        """排入使用者的工作，回傳 Future；工作在提交時的 contextvars context 中執行 (保留追蹤的 span)"""
+        future = Future()
+        context = contextvars.copy_context()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("FairScheduler 已關閉")
+            self._ensure_started()
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._active.append(user_id)
+                self._deficits[user_id] = 0
+            queue.append((cost, fn, future, context))
+            self._cond.notify()
+        return future
+
+    def queued(self, user_id=None):
+        """等待中的工作數量"""
+        with self._cond:
+            if user_id is not None:
+                return len(self._queues.get(user_id, ()))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def pending(self):
+        """等待中與執行中的工作數量"""
+        with self._cond:
+            return self._running + sum(len(queue) for queue in self._queues.values())
+
+    def _next_task(self):
+        # 呼叫時需持有 self._cond
+        while True:
+            user_id = self._active[0]
+            queue = self._queues[user_id]
+            cost = queue[0][0]
+            if self._deficits[user_id] < cost:
+                self._deficits[user_id] += self.quantum
+                self._active.rotate(-1)
+                continue
+
+            self._deficits[user_id] -= cost
+            task = queue.popleft()
+            if not queue:
+                # 佇列清空時額度歸零，避免閒置使用者累積額度
+                self._active.popleft()
+                del self._queues[user_id]
+                del self._deficits[user_id]
+            elif self._deficits[user_id] < queue[0][0]:
+                self._active.rotate(-1)
+            return task
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._active and not self._shutdown:
+                    self._cond.wait()
+                if not self._active:
+                    return
+                cost, fn, future, context = self._next_task()
+                self._running += 1
+
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(context.run(fn))
+                except BaseException as e:
+                    future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def shutdown(self, wait=True):
+        """停止接受新工作，等待已排入的工作完成"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
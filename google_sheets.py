@@ -5,23 +5,41 @@ from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
+from storage_backends import SheetsStorageBackend
+from circuit_breaker import CircuitBreaker
+from tracing import tracer
+from sheet_row import format_file_timestamp
+from drive_stream_upload import create_media_upload, upload_stream_to_drive, build_media_filename, describe_media
 import json
 import logging
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-class GoogleSheetsHandler:
+class GoogleSheetsHandler(SheetsStorageBackend):
     def __init__(self):
+        super().__init__()
         self.SCOPES = [
             'https://www.googleapis.com/auth/spreadsheets',
             'https://www.googleapis.com/auth/drive'
         ]
-        self.SPREADSHEET_ID = os.getenv('GOOGLE_SPREADSHEET_ID')
-        self.DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')  # 可選，用於指定儲存資料夾
-        self.RANGE_NAME = 'A:E'  # 預設範圍: A到E欄
-        self.service = self._authenticate()
-        self.drive_service = self._authenticate_drive()
+        # 啟動時先建立 client 以驗證憑證
+        self.service
+        self.drive_service
+        
+        # 服務帳戶配額用盡時，Drive 斷路器開啟的秒數
+        self.QUOTA_RESET_TIMEOUT = float(os.getenv('CIRCUIT_QUOTA_RESET_TIMEOUT', '3600'))
+        self.imgbb_breaker = CircuitBreaker('imgbb')
+    
+    def breaker_states(self):
+        states = super().breaker_states()
+        states['imgbb'] = self.imgbb_breaker.snapshot()
+        return states
+    
+    def _create_sheets_service(self):
+        return self._authenticate()
+    
+    def _create_drive_service(self):
+        return self._authenticate_drive()
     
     def _get_credentials(self):
         """取得 Google API 憑證"""
@@ -73,9 +91,10 @@ class GoogleSheetsHandler:
     def _authenticate(self):
         """Google Sheets API 認證 - 使用服務帳戶"""
         try:
-            creds = self._get_credentials()
+            if self.creds is None:
+                self.creds = self._get_credentials()
             logger.info("Google Sheets API 認證成功")
-            return build('sheets', 'v4', credentials=creds)
+            return build('sheets', 'v4', credentials=self.creds)
         except Exception as e:
             logger.error(f"Google Sheets 認證失敗: {e}")
             raise
@@ -83,41 +102,14 @@ class GoogleSheetsHandler:
     def _authenticate_drive(self):
         """Google Drive API 認證 - 使用服務帳戶"""
         try:
-            creds = self._get_credentials()
+            if self.creds is None:
+                self.creds = self._get_credentials()
             logger.info("Google Drive API 認證成功")
-            return build('drive', 'v3', credentials=creds)
+            return build('drive', 'v3', credentials=self.creds)
         except Exception as e:
             logger.error(f"Google Drive 認證失敗: {e}")
             raise
     
-    def save_message(self, user_id, message, message_type, timestamp):
-        """儲存訊息到Google Sheets"""
-        try:
-            values = [
-                [timestamp, user_id, message_type, message, '']
-            ]
-            
-            body = {
-                'values': values
-            }
-            
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=self.RANGE_NAME,
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            logger.info(f"Message saved to Google Sheets: {result.get('updates', {}).get('updatedCells', 0)} cells updated")
-            return True
-            
-        except HttpError as error:
-            logger.error(f"Google Sheets API error: {error}")
-            return False
-        except Exception as error:
-            logger.error(f"Error saving message: {error}")
-            return False
-    
     def _verify_drive_folder(self):
         """驗證 Google Drive 資料夾是否可存取"""
         if not self.DRIVE_FOLDER_ID:
@@ -137,94 +129,69 @@ class GoogleSheetsHandler:
             logger.error(f"Drive 資料夾驗證錯誤: {error}")
             return None
 
-    def _save_image_as_base64(self, image_data, filename):
-        """備用方案：將圖片轉換為 Base64 並儲存到 Google Sheets"""
-        try:
-            logger.info(f"使用 Base64 備用方案儲存圖片: {filename}")
-            
-            # 將圖片轉換為 base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            # 建立一個簡單的 HTML 頁面來顯示圖片
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head><title>{filename}</title></head>
-            <body>
-                <h2>LINE Bot 圖片</h2>
-                <p>檔案名稱: {filename}</p>
-                <img src="data:image/jpeg;base64,{image_base64}" style="max-width:100%;height:auto;" />
-            </body>
-            </html>
-            """
+    @tracer.traced('storage.upload_image')
+    def upload_image(self, image_data, message_id):
+        """上傳圖片 (Drive 或備用方案)，回傳 (內容描述, 圖片連結)，不寫入 Google Sheets"""
+        # 生成檔案名稱
+        filename = f"linebot_image_{message_id}_{format_file_timestamp()}.jpg"
+        
+        # 先嘗試上傳到 Google Drive
+        drive_result = self._try_drive_upload(image_data, filename)
+        
+        if drive_result and drive_result.startswith('https://'):
+            # Drive 上傳成功
+            image_info = f"圖片大小: {len(image_data)} bytes"
+            image_url = drive_result
             
-            # 這裡可以考慮使用其他免費圖床服務
-            # 暫時返回一個說明連結
-            info_url = f"data:text/html;base64,{base64.b64encode(html_content.encode()).decode()}"
+            logger.info(f"圖片成功上傳到 Google Drive: {image_url}")
             
-            logger.info("已使用 Base64 方案處理圖片")
-            return f"[Base64圖片] 大小: {len(image_data)} bytes"
+        else:
+            # Drive 上傳失敗，只記錄圖片大小
+            logger.info(f"Drive 上傳失敗，只記錄圖片大小: {filename}")
             
-        except Exception as e:
-            logger.error(f"Base64 備用方案失敗: {e}")
-            return None
+            image_info = f"Base64 圖片 - 大小: {len(image_data)} bytes"
+            image_url = "Base64 儲存 (無法上傳到 Drive)"
+        
+        return image_info, image_url
 
-    def save_image(self, user_id, image_data, message_id, timestamp):
-        """儲存圖片到Google Drive並將連結存到Google Sheets"""
-        try:
-            # 生成檔案名稱
-            filename = f"linebot_image_{message_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            
-            # 先嘗試上傳到 Google Drive
-            drive_result = self._try_drive_upload(image_data, filename)
-            
-            if drive_result and drive_result.startswith('https://'):
-                # Drive 上傳成功
-                image_info = f"圖片大小: {len(image_data)} bytes"
-                image_url = drive_result
-                
-                values = [
-                    [timestamp, user_id, 'image', image_info, image_url]
-                ]
-                
-                logger.info(f"圖片成功上傳到 Google Drive: {image_url}")
-                
-            else:
-                # Drive 上傳失敗，使用 Base64 備用方案
-                logger.info("Drive 上傳失敗，使用 Base64 備用方案")
-                base64_info = self._save_image_as_base64(image_data, filename)
-                
-                image_info = f"Base64 圖片 - 大小: {len(image_data)} bytes"
-                image_url = "Base64 儲存 (無法上傳到 Drive)"
-                
-                values = [
-                    [timestamp, user_id, 'image', image_info, image_url]
-                ]
-            
-            # 儲存到 Google Sheets
-            body = {
-                'values': values
-            }
-            
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=self.RANGE_NAME,
-                valueInputOption='RAW',
-                body=body
+    @tracer.traced('storage.upload_media')
+    def upload_media(self, chunks, message_id, message_type, mimetype, file_name=None, size=None):
+        """串流上傳影片/語音/檔案到Google Drive，回傳 (內容描述, 檔案連結)"""
+        filename = build_media_filename(message_id, message_type, file_name)
+        valid_folder_id = self._verify_drive_folder()
+        
+        file_metadata = {
+            'name': filename,
+            'parents': [valid_folder_id] if valid_folder_id else []
+        }
+        
+        logger.info(f"準備串流上傳: {filename} ({size if size is not None else '未知'} bytes)")
+        
+        media = create_media_upload(chunks, mimetype, size)
+        file = upload_stream_to_drive(
+            self.drive_service, file_metadata, media,
+            fields='id,size'
+        )
+        
+        file_id = file.get('id')
+        logger.info(f"檔案上傳成功，ID: {file_id}")
+        
+        # 設定檔案權限為公開可讀取
+        with tracer.span('drive.permissions.create', kind='CLIENT'):
+            self.drive_service.permissions().create(
+                fileId=file_id,
+                body={'type': 'anyone', 'role': 'reader'}
             ).execute()
-            
-            logger.info(f"Image saved to Google Sheets: {result.get('updates', {}).get('updatedCells', 0)} cells updated")
-            return image_url
-            
-        except HttpError as error:
-            logger.error(f"Google Sheets API error: {error}")
-            return None
-        except Exception as error:
-            logger.error(f"Error saving image: {error}")
-            return None
-
+        
+        view_link = f"https://drive.google.com/file/d/{file_id}/view"
+        return describe_media(message_type, file.get('size', size), file_name), view_link
+    
     def _try_drive_upload(self, image_data, filename):
         """嘗試上傳到 Google Drive，成功返回 URL，失敗返回 None"""
+        if not self.drive_breaker.allow_request():
+            logger.info("Drive 斷路器開啟中，略過 Drive 直接使用免費圖床")
+            return self._upload_to_imgbb(image_data, filename)
+        
         try:
             # 驗證並取得有效的資料夾 ID
             valid_folder_id = self._verify_drive_folder()
@@ -245,11 +212,12 @@ class GoogleSheetsHandler:
             )
             
             # 上傳檔案
-            file = self.drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id,name,parents'
-            ).execute()
+            with tracer.span('drive.files.create', kind='CLIENT', bytes=len(image_data)):
+                file = self.drive_service.files().create(
+                    body=file_metadata,
+                    media_body=media,
+                    fields='id,name,parents'
+                ).execute()
             
             file_id = file.get('id')
             logger.info(f"檔案上傳成功，ID: {file_id}")
@@ -260,10 +228,11 @@ class GoogleSheetsHandler:
                 'role': 'reader'
             }
             
-            self.drive_service.permissions().create(
-                fileId=file_id,
-                body=permission
-            ).execute()
+            with tracer.span('drive.permissions.create', kind='CLIENT'):
+                self.drive_service.permissions().create(
+                    fileId=file_id,
+                    body=permission
+                ).execute()
             
             logger.info("檔案權限設定完成")
             
@@ -271,19 +240,25 @@ class GoogleSheetsHandler:
             download_url = f"https://drive.google.com/file/d/{file_id}/view"
             
             logger.info(f"Image uploaded to Google Drive: {download_url}")
+            self.drive_breaker.record_success()
             return download_url
             
         except HttpError as error:
             if 'storageQuotaExceeded' in str(error):
                 logger.error("服務帳戶沒有儲存配額，嘗試使用免費圖床")
+                # 配額不會很快恢復，斷路器開啟較長時間
+                self.drive_breaker.record_failure('storageQuotaExceeded', open_for=self.QUOTA_RESET_TIMEOUT)
                 return self._upload_to_imgbb(image_data, filename)
             else:
                 logger.error(f"Google Drive API error: {error}")
+                self.drive_breaker.record_failure(error)
             return None
         except Exception as error:
             logger.error(f"Error uploading image to Drive: {error}")
+            self.drive_breaker.record_failure(error)
             return None
 
+    @tracer.traced('imgbb.upload', kind='CLIENT')
     def _upload_to_imgbb(self, image_data, filename):
         """使用 ImgBB 免費圖床作為備用方案"""
         try:
@@ -293,28 +268,20 @@ class GoogleSheetsHandler:
             api_key = os.getenv('IMGBB_API_KEY')  # 可選設定
             
             if not api_key:
-                logger.info("未設定 IMGBB_API_KEY，使用匿名上傳")
-                # 使用匿名上傳 (限制較多但免費)
-                url = "https://api.imgbb.com/1/upload"
-                
-                # 轉換為 base64
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                
-                # 匿名上傳到免費圖床
-                payload = {
-                    'image': image_base64,
-                    'name': filename
-                }
-                
-                # 先嘗試不需要 API key 的服務
-                return self._try_alternative_image_host(image_data, filename)
+                logger.info("未設定 IMGBB_API_KEY，略過 ImgBB 上傳")
+                return None
             else:
                 # 有 API key 的情況
-                url = f"https://api.imgbb.com/1/upload?key={api_key}"
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
+                if not self.imgbb_breaker.allow_request():
+                    logger.info("ImgBB 斷路器開啟中，略過 ImgBB 上傳")
+                    return None
                 
+                url = "https://api.imgbb.com/1/upload"
+                # API key 放在表單中而非 URL，連線錯誤的例外訊息才不會帶出 key
+                # requests 可直接 urlencode bytes，不需要先轉成 str
                 payload = {
-                    'image': image_base64,
+                    'key': api_key,
+                    'image': base64.b64encode(image_data),
                     'name': filename
                 }
                 
@@ -325,54 +292,14 @@ class GoogleSheetsHandler:
                     if result.get('success'):
                         image_url = result['data']['url']
                         logger.info(f"圖片成功上傳到 ImgBB: {image_url}")
+                        self.imgbb_breaker.record_success()
                         return image_url
                 
                 logger.error(f"ImgBB 上傳失敗: {response.text}")
+                self.imgbb_breaker.record_failure(f"HTTP {response.status_code}")
                 return None
                 
         except Exception as e:
             logger.error(f"免費圖床上傳失敗: {e}")
+            self.imgbb_breaker.record_failure(e)
             return None
-
-    def _try_alternative_image_host(self, image_data, filename):
-        """嘗試其他免費圖片託管方案"""
-        try:
-            # 方案：將圖片儲存為 data URL (適合小圖片)
-            if len(image_data) < 100000:  # 小於 100KB
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                data_url = f"data:image/jpeg;base64,{image_base64}"
-                logger.info(f"使用 Data URL 方案 (圖片大小: {len(image_data)} bytes)")
-                return data_url
-            else:
-                logger.warning("圖片過大，無法使用 Data URL，改用描述方式")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Data URL 方案失敗: {e}")
-            return None
-    
-    def create_headers(self):
-        """建立Google Sheets的表頭"""
-        try:
-            headers = [['時間戳記', '使用者ID', '訊息類型', '內容', '額外資訊']]
-            
-            body = {
-                'values': headers
-            }
-            
-            result = self.service.spreadsheets().values().update(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='A1:E1',
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            logger.info("Headers created in Google Sheets")
-            return True
-            
-        except HttpError as error:
-            logger.error(f"Google Sheets API error: {error}")
-            return False
-        except Exception as error:
-            logger.error(f"Error creating headers: {error}")
-            return False
\ No newline at end of file
@@ -4,33 +4,33 @@ import base64
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
+from storage_backends import SheetsStorageBackend
+from circuit_breaker import CircuitOpenError
+from tracing import tracer
+from sheet_row import format_file_timestamp
+from drive_stream_upload import create_media_upload, upload_stream_to_drive, build_media_filename, describe_media
 import json
 import logging
-from datetime import datetime
 import io
 
 logger = logging.getLogger(__name__)
 
-class GoogleSheetsOAuthHandler:
+class GoogleSheetsOAuthHandler(SheetsStorageBackend):
     def __init__(self):
+        super().__init__()
         self.SCOPES = [
             'https://www.googleapis.com/auth/spreadsheets',
             'https://www.googleapis.com/auth/drive.file'
         ]
-        self.SPREADSHEET_ID = os.getenv('GOOGLE_SPREADSHEET_ID')
-        self.DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
-        self.RANGE_NAME = 'A:E'
         
         # OAuth2 認證檔案路徑
         self.TOKEN_FILE = 'token.pickle'
         self.CREDENTIALS_FILE = 'oauth_credentials.json'
         
         self.creds = self._authenticate()
-        self.service = build('sheets', 'v4', credentials=self.creds)
-        self.drive_service = build('drive', 'v3', credentials=self.creds)
+        self.service
+        self.drive_service
     
     def _authenticate(self):
         """使用 OAuth2 進行認證"""
@@ -95,134 +95,83 @@ class GoogleSheetsOAuthHandler:
         
         return creds
     
-    def save_message(self, user_id, message, message_type, timestamp):
-        """儲存訊息到Google Sheets"""
-        try:
-            values = [
-                [timestamp, user_id, message_type, message, '']
-            ]
-            
-            body = {
-                'values': values
-            }
-            
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=self.RANGE_NAME,
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            logger.info(f"Message saved to Google Sheets: {result.get('updates', {}).get('updatedCells', 0)} cells updated")
-            return True
-            
-        except HttpError as error:
-            logger.error(f"Google Sheets API error: {error}")
-            return False
-        except Exception as error:
-            logger.error(f"Error saving message: {error}")
-            return False
-    
-    def save_image(self, user_id, image_data, message_id, timestamp):
-        """儲存圖片到Google Drive並將連結存到Google Sheets"""
+    @tracer.traced('storage.upload_image')
+    def upload_image(self, image_data, message_id):
+        """上傳圖片到Google Drive，回傳 (內容描述, 圖片連結)，不寫入 Google Sheets"""
+        if not self.drive_breaker.allow_request():
+            raise CircuitOpenError("Drive 斷路器開啟中，暫停上傳圖片")
+        
+        # 生成檔案名稱
+        filename = f"linebot_image_{message_id}_{format_file_timestamp()}.jpg"
+        
+        # 建立檔案 metadata
+        file_metadata = {
+            'name': filename
+        }
+        
+        # 如果有指定資料夾，先驗證是否存在
+        if self.DRIVE_FOLDER_ID:
+            try:
+                # 測試資料夾是否存在
+                folder = self.drive_service.files().get(fileId=self.DRIVE_FOLDER_ID).execute()
+                file_metadata['parents'] = [self.DRIVE_FOLDER_ID]
+                logger.info(f"將上傳到資料夾: {folder.get('name', 'Unknown')}")
+            except Exception as e:
+                logger.warning(f"無法存取指定資料夾 {self.DRIVE_FOLDER_ID}: {e}")
+                logger.info("改為上傳到根目錄")
+        
+        logger.info(f"準備上傳圖片: {filename}")
+        
+        # 建立媒體上傳物件
+        media = MediaIoBaseUpload(
+            io.BytesIO(image_data),
+            mimetype='image/jpeg',
+            resumable=True
+        )
+        
+        # 上傳檔案
         try:
-            # 生成檔案名稱
-            filename = f"linebot_image_{message_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            
-            # 建立檔案 metadata
-            file_metadata = {
-                'name': filename
-            }
-            
-            # 如果有指定資料夾，先驗證是否存在
-            if self.DRIVE_FOLDER_ID:
-                try:
-                    # 測試資料夾是否存在
-                    folder = self.drive_service.files().get(fileId=self.DRIVE_FOLDER_ID).execute()
-                    file_metadata['parents'] = [self.DRIVE_FOLDER_ID]
-                    logger.info(f"將上傳到資料夾: {folder.get('name', 'Unknown')}")
-                except Exception as e:
-                    logger.warning(f"無法存取指定資料夾 {self.DRIVE_FOLDER_ID}: {e}")
-                    logger.info("改為上傳到根目錄")
-            
-            logger.info(f"準備上傳圖片: {filename}")
-            
-            # 建立媒體上傳物件
-            media = MediaIoBaseUpload(
-                io.BytesIO(image_data),
-                mimetype='image/jpeg',
-                resumable=True
-            )
-            
-            # 上傳檔案
-            file = self.drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id,webViewLink,webContentLink'
-            ).execute()
-            
-            file_id = file.get('id')
-            logger.info(f"檔案上傳成功，ID: {file_id}")
-            
-            # 取得分享連結
-            # 使用 webViewLink 可以直接在瀏覽器中查看
-            view_link = file.get('webViewLink')
-            
-            # 儲存到 Google Sheets
-            image_info = f"圖片大小: {len(image_data)} bytes"
-            values = [
-                [timestamp, user_id, 'image', image_info, view_link]
-            ]
-            
-            body = {
-                'values': values
-            }
-            
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=self.RANGE_NAME,
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            logger.info(f"Image saved to Google Sheets: {result.get('updates', {}).get('updatedCells', 0)} cells updated")
-            return view_link
-            
-        except HttpError as error:
-            if error.resp.status == 403:
-                logger.error("權限不足：請確認 OAuth 範圍包含 Drive 存取權限")
-            else:
-                logger.error(f"Google Drive API error: {error}")
-            return None
+            with tracer.span('drive.files.create', kind='CLIENT', bytes=len(image_data)):
+                file = self.drive_service.files().create(
+                    body=file_metadata,
+                    media_body=media,
+                    fields='id,webViewLink,webContentLink'
+                ).execute()
         except Exception as error:
-            logger.error(f"Error saving image: {error}")
-            return None
+            self.drive_breaker.record_failure(error)
+            raise
+        self.drive_breaker.record_success()
+        
+        file_id = file.get('id')
+        logger.info(f"檔案上傳成功，ID: {file_id}")
+        
+        # 取得分享連結
+        # 使用 webViewLink 可以直接在瀏覽器中查看
+        view_link = file.get('webViewLink')
+        image_info = f"圖片大小: {len(image_data)} bytes"
+        return image_info, view_link
     
-    def create_headers(self):
-        """建立Google Sheets的表頭"""
-        try:
-            headers = [['時間戳記', '使用者ID', '訊息類型', '內容', '額外資訊']]
-            
-            body = {
-                'values': headers
-            }
-            
-            result = self.service.spreadsheets().values().update(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='A1:E1',
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            logger.info("Headers created in Google Sheets")
-            return True
-            
-        except HttpError as error:
-            logger.error(f"Google Sheets API error: {error}")
-            return False
-        except Exception as error:
-            logger.error(f"Error creating headers: {error}")
-            return False
+    @tracer.traced('storage.upload_media')
+    def upload_media(self, chunks, message_id, message_type, mimetype, file_name=None, size=None):
+        """串流上傳影片/語音/檔案到Google Drive，回傳 (內容描述, 檔案連結)"""
+        filename = build_media_filename(message_id, message_type, file_name)
+        
+        file_metadata = {
+            'name': filename
+        }
+        if self.DRIVE_FOLDER_ID:
+            file_metadata['parents'] = [self.DRIVE_FOLDER_ID]
+        
+        logger.info(f"準備串流上傳: {filename} ({size if size is not None else '未知'} bytes)")
+        
+        media = create_media_upload(chunks, mimetype, size)
+        file = upload_stream_to_drive(
+            self.drive_service, file_metadata, media,
+            fields='id,size,webViewLink'
+        )
+        
+        logger.info(f"檔案上傳成功，ID: {file.get('id')}")
+        return describe_media(message_type, file.get('size', size), file_name), file.get('webViewLink')
     
     def test_connection(self):
         """測試 Google API 連接"""
@@ -246,4 +195,4 @@ class GoogleSheetsOAuthHandler:
             
         except Exception as error:
             logger.error(f"連接測試失敗: {error}")
-            return False
\ No newline at end of file
+            return False
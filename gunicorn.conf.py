@@ -0,0 +1,122 @@
+"""
+gunicorn 正式環境設定
+啟動：gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import time
+import signal
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Webhook 處理大多在等待 LINE / Google API，使用多執行緒 worker；
+# 每個 worker 是獨立程序，可以使用多個 CPU 核心
+worker_class = 'gthread'
+# 未設定 WEB_CONCURRENCY 時的上限：每個 worker 有自己的執行緒與搜尋索引，也會倍增對 Google API 的並行數
+MAX_DEFAULT_WORKERS = 4
+
+
+def available_cpus():
+    """容器可用的 CPU 數：取 CPU affinity 與 cgroup 配額 (cpu.max / cfs_quota_us) 中較小者
+
+    cpu_count() 回傳的是主機的核心數，在容器平台上可能是數十個
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()[:2]
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota + 0.5)))
+    return cpus
+
+
+workers = int(os.getenv('WEB_CONCURRENCY', min(available_cpus(), MAX_DEFAULT_WORKERS)))
+# 讓 app 得知實際的 worker 數 (例如游標寫入模式只支援單一 worker)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# 在 master 先載入 app，Google API client 與憑證只初始化一次，fork 後的 worker 直接共用
+preload_app = True
+
+# 定期回收 worker，避免長時間執行累積記憶體；jitter 讓 worker 不會同時重啟
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# 影片/檔案以串流上傳，單一請求可能較久
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# 關閉時間預算：master 在送出 SIGTERM 後 graceful_timeout 秒就 SIGKILL worker (從 SIGTERM 起算)，
+# 這段時間內 gthread worker 先等待進行中的連線，之後 worker_exit 才排空背景上傳並寫入剩餘資料列，
+# 所以 graceful_timeout 需包含兩者；總和需短於平台的強制結束期限
+connection_grace = int(os.getenv('GUNICORN_CONNECTION_GRACE', '10'))
+drain_timeout = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '25'))
+# 最後一次批次寫入 Google Sheets 預留的時間
+flush_margin = 5
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', connection_grace + drain_timeout + flush_margin))
+keepalive = 5
+
+# 設為空字串可關閉 access log (負載測試時使用)
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def pre_request(worker, req):
+    """影片/檔案上傳進行中時延後 max_requests 回收
+
+    回收時 worker_exit 只排空 drain_timeout 秒，之後程序結束，背景上傳的執行緒也隨之中止；
+    上傳可能持續數分鐘，所以等上傳都完成後的下一個請求才回收。
+    """
+    worker.log.debug("%s %s", req.method, req.path)
+    if worker.nr + 1 >= worker.max_requests:
+        from app import media_scheduler
+        if media_scheduler.pending():
+            worker.max_requests = worker.nr + 2
+
+
+def post_worker_init(worker):
+    """記錄收到 SIGTERM 的時間，worker_exit 依剩餘時間決定排空多久；並在背景開始啟動重建"""
+    handle_exit = worker.handle_exit
+
+    def _handle_exit(sig, frame):
+        worker.shutdown_started = time.monotonic()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, _handle_exit)
+
+    # preload 時 app 在 master 載入，背景執行緒要在 fork 之後的 worker 中啟動
+    from app import startup_rebuild
+    startup_rebuild.start()
+
+
+def worker_exit(server, worker):
+    """worker 結束前排空背景上傳並 flush 待寫入的資料列
+
+    進行中的連線可能已用掉部分 graceful_timeout，排空時間取剩餘時間扣掉寫入預留，
+    確保最後一次寫入在 SIGKILL 之前完成。
+    """
+    from app import shutdown_coordinator
+    timeout = drain_timeout
+    started = getattr(worker, 'shutdown_started', None)
+    if started is not None:
+        remaining = started + graceful_timeout - flush_margin - time.monotonic()
+        timeout = max(0, min(timeout, remaining))
+    shutdown_coordinator.drain(timeout)
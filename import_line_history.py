@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+匯入 LINE 聊天記錄 (.txt) 到 Google Sheets
+以串流方式解析匯出檔，轉成與 save_message 相同的 [時間戳記, 使用者ID, 訊息類型, 內容, 額外資訊] 格式，
+並以大批次 append 寫入以節省 API 配額；支援檢查點續傳
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import logging
+from datetime import datetime
+from dotenv import load_dotenv
+from export_sheet import create_sheets_handler
+from sheet_row import SheetRow
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_MIN_INTERVAL = 1.0  # Sheets 寫入配額約每分鐘 60 次
+DEFAULT_CHECKPOINT_FILE = 'import_checkpoint.json'
+
+# 日期列，例如 "2024/01/01(Mon)"、"2024/01/01（一）"、"2024.01.01 星期一"
+DATE_LINE = re.compile(r'^(\d{4})[/.](\d{1,2})[/.](\d{1,2})\s*(?:[(（][^)）]*[)）]|星期.|週.)?\s*$')
+# 訊息列，例如 "09:15\tAlice\tHello"、"下午01:20\tBob\t[照片]"、"1:20 PM\tBob\tHi"
+MESSAGE_LINE = re.compile(r'^(上午|下午|AM|PM)?\s*(\d{1,2}):(\d{2})\s*(AM|PM)?\t([^\t]*)\t(.*)$')
+# 系統訊息只有時間和一個欄位，例如 "09:00\tAlice加入群組"
+SYSTEM_LINE = re.compile(r'^(上午|下午|AM|PM)?\s*\d{1,2}:\d{2}\s*(AM|PM)?\t[^\t]*$')
+
+MESSAGE_TYPES = {
+    '[照片]': 'image', '[Photo]': 'image', '[Photos]': 'image', '[图片]': 'image',
+    '[貼圖]': 'sticker', '[Sticker]': 'sticker', '[贴图]': 'sticker',
+    '[影片]': 'video', '[Video]': 'video', '[视频]': 'video',
+    '[語音訊息]': 'audio', '[Voice message]': 'audio', '[Audio]': 'audio',
+    '[檔案]': 'file', '[File]': 'file',
+}
+
+
+def _to_24_hour(hour, meridiem):
+    if meridiem in ('下午', 'PM') and hour < 12:
+        return hour + 12
+    if meridiem in ('上午', 'AM') and hour == 12:
+        return 0
+    return hour
+
+
+def _finish_message(message):
+    lines = message['lines']
+    while len(lines) > 1 and not lines[-1]:
+        lines.pop()
+    content = '\n'.join(lines)
+    # 多行訊息在匯出檔中會以引號包住
+    if len(lines) > 1 and content.startswith('"') and content.endswith('"'):
+        content = content[1:-1].replace('""', '"')
+    message_type = MESSAGE_TYPES.get(content.strip(), 'text')
+    return message['timestamp'], message['sender'], message_type, content
+
+
+def parse_line_history(lines):
+    """逐行解析 LINE 聊天記錄，產生 (時間戳記, 發送者, 訊息類型, 內容)"""
+    current_date = None
+    message = None
+    for raw_line in lines:
+        line = raw_line.rstrip('\r\n')
+
+        date_match = DATE_LINE.match(line)
+        if date_match:
+            if message:
+                yield _finish_message(message)
+                message = None
+            year, month, day = (int(x) for x in date_match.groups())
+            current_date = (year, month, day)
+            continue
+
+        message_match = MESSAGE_LINE.match(line) if current_date else None
+        if message_match:
+            if message:
+                yield _finish_message(message)
+            prefix, hour, minute, suffix, sender, text = message_match.groups()
+            hour = _to_24_hour(int(hour), prefix or suffix)
+            timestamp = datetime(*current_date, hour, int(minute)).strftime('%Y-%m-%d %H:%M:%S')
+            message = {'timestamp': timestamp, 'sender': sender, 'lines': [text]}
+            continue
+
+        if current_date and SYSTEM_LINE.match(line):
+            if message:
+                yield _finish_message(message)
+                message = None
+            continue
+
+        if message:
+            # 多行訊息的延續 (尾端空白列在結束訊息時去除)
+            message['lines'].append(line)
+
+    if message:
+        yield _finish_message(message)
+
+
+def iter_history_rows(path, user_map=None):
+    """串流讀取匯出檔並轉成 Google Sheets 資料列"""
+    user_map = user_map or {}
+    extra = f"LINE 匯入: {os.path.basename(path)}"
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for timestamp, sender, message_type, content in parse_line_history(f):
+            user_id = user_map.get(sender, sender)
+            yield SheetRow(timestamp, user_id, message_type, content, extra)
+
+
+class ImportCheckpoint:
+    """記錄每個檔案已寫入的訊息數，用於中斷後續傳"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def rows_done(self, source):
+        return self.state.get(os.path.abspath(source), 0)
+
+    def update(self, source, rows_done):
+        self.state[os.path.abspath(source)] = rows_done
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class HistoryImporter:
+    def __init__(self, sheets_handler, checkpoint, batch_rows=DEFAULT_BATCH_ROWS,
+                 min_interval=DEFAULT_MIN_INTERVAL, max_retries=5):
+        self.sheets_handler = sheets_handler
+        self.checkpoint = checkpoint
+        self.batch_rows = batch_rows
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self._last_write = 0.0
+        self.rows_written = 0
+
+    def _append_with_retry(self, rows):
+        for attempt in range(self.max_retries + 1):
+            wait = self.min_interval - (time.monotonic() - self._last_write)
+            if wait > 0:
+                time.sleep(wait)
+            self._last_write = time.monotonic()
+            if self.sheets_handler.append_rows(rows):
+                return True
+            backoff = min(2 ** attempt, 60)
+            logger.warning(f"批次寫入失敗，{backoff}s 後重試 ({attempt + 1}/{self.max_retries})")
+            time.sleep(backoff)
+        return False
+
+    def import_file(self, path, user_map=None):
+        """匯入單一檔案，回傳此次寫入的列數"""
+        done = self.checkpoint.rows_done(path)
+        if done:
+            logger.info(f"{path}: 從檢查點續傳，略過前 {done} 則訊息")
+
+        written = 0
+        started = time.monotonic()
+        batch = []
+        for index, row in enumerate(iter_history_rows(path, user_map)):
+            if index < done:
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_rows:
+                written += self._flush(path, batch, done + written)
+                batch = []
+                elapsed = time.monotonic() - started
+                logger.info(f"{path}: 已寫入 {done + written} 列 ({written / elapsed:.0f} rows/sec)")
+        if batch:
+            written += self._flush(path, batch, done + written)
+        return written
+
+    def _flush(self, path, batch, rows_before):
+        if not self._append_with_retry(batch):
+            raise RuntimeError(f"寫入 Google Sheets 失敗，已寫入 {rows_before} 列，可重新執行以續傳")
+        self.checkpoint.update(path, rows_before + len(batch))
+        self.rows_written += len(batch)
+        return len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='匯入 LINE 聊天記錄到 Google Sheets')
+    parser.add_argument('files', nargs='+', help='LINE 匯出的聊天記錄 .txt 檔案')
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS,
+                        help=f'每次 append 的列數 (預設: {DEFAULT_BATCH_ROWS})')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help=f'兩次寫入之間的最短間隔秒數 (預設: {DEFAULT_MIN_INTERVAL})')
+    parser.add_argument('--checkpoint-file', default=DEFAULT_CHECKPOINT_FILE,
+                        help=f'檢查點檔案 (預設: {DEFAULT_CHECKPOINT_FILE})')
+    parser.add_argument('--user-map',
+                        help='JSON 檔，將聊天記錄中的顯示名稱對應到 LINE 使用者ID；未對應的名稱直接作為使用者ID')
+    parser.add_argument('--auth', choices=['oauth', 'service-account'], default='oauth',
+                        help='Google API 認證方式 (預設: oauth)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    user_map = None
+    if args.user_map:
+        with open(args.user_map, 'r', encoding='utf-8') as f:
+            user_map = json.load(f)
+
+    started = time.monotonic()
+    importer = None
+    try:
+        sheets_handler = create_sheets_handler(args.auth)
+        importer = HistoryImporter(
+            sheets_handler, ImportCheckpoint(args.checkpoint_file),
+            args.batch_rows, args.min_interval)
+        for path in args.files:
+            written = importer.import_file(path, user_map)
+            print(f"✅ {path}: 寫入 {written} 列")
+    except Exception as e:
+        print(f"❌ 匯入失敗：{e}")
+        sys.exit(1)
+    finally:
+        if importer:
+            elapsed = time.monotonic() - started
+            rate = importer.rows_written / elapsed if elapsed > 0 else 0
+            print(f"共寫入 {importer.rows_written} 列，耗時 {elapsed:.2f}s，{rate:.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
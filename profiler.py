@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# 同一個 worker 同時只執行一個 profiler，避免互相干擾
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """已有其他 profiler 正在執行"""
+
+
+def _frame_label(code):
+    # collapsed stack 以分號分隔，標籤中不能出現分號
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(';', ':')
+
+
+def sample_stacks(duration, interval=0.01):
+    """以 sys._current_frames() 定期取樣所有執行緒的 stack，回傳 Counter[collapsed stack]
+
+    只在呼叫的執行緒中執行，不需要安裝任何 hook；取樣期間其他請求照常處理。
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("已有 profiler 正在執行")
+    try:
+        own_thread = threading.get_ident()
+        counts = Counter()
+        labels = {}  # code object -> 標籤，避免每次取樣重新格式化
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}").replace(';', ':'))
+                stack.reverse()
+                counts[';'.join(stack)] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(counts):
+    """輸出 Brendan Gregg 的 collapsed 格式，可直接交給 flamegraph.pl 或 speedscope"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+已儲存文字訊息的關鍵字搜尋 (/search)
+以倒排索引 (token -> 訊息 ID) 在本地查詢，不需要呼叫 Google Sheets API。
+英數字以單字為 token，中日韓文字以相鄰兩字 (bigram) 為 token。
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import unicodedata
+import logging
+from dotenv import load_dotenv
+from export_sheet import iter_sheet_rows
+
+logger = logging.getLogger(__name__)
+
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TOKEN_PATTERN = re.compile(f"([{CJK_CHARS}]+)|([^\\W_{CJK_CHARS}]+)")
+INDEX_FORMAT_VERSION = 1
+REBUILD_BATCH_ROWS = 1000
+
+
+def tokenize(text):
+    """回傳 token 列表：英數字轉小寫後的單字，中日韓文字切成 bigram (單獨一個字時保留單字)"""
+    tokens = []
+    for cjk, word in TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def _delta_encode(ids):
+    return [ids[0]] + [b - a for a, b in zip(ids, ids[1:])] if ids else []
+
+
+def _delta_decode(deltas):
+    ids = []
+    total = 0
+    for delta in deltas:
+        total += delta
+        ids.append(total)
+    return ids
+
+
+class SearchIndex:
+    """每位使用者各自的倒排索引
+
+    訊息本文存在 SQLite (多個 gunicorn worker 共用)，每個 worker 在記憶體中維護倒排索引，
+    搜尋前只讀取 ID 大於已索引部分的新訊息補上。索引在關閉時與重建後以 gzip JSON
+    (posting list 以差值編碼) 存檔，重新啟動時載入後只需補上之後的新訊息。
+    """
+
+    def __init__(self, path=None, snapshot_path=None):
+        self.path = path or os.getenv('SEARCH_DB_PATH', 'search_index.db')
+        self.snapshot_path = snapshot_path or os.getenv('SEARCH_INDEX_PATH', 'search_index.json.gz')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._postings = {}  # user_id -> {token: [訊息 ID (遞增)]}
+        self._last_id = 0
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS search_docs ('
+                ' id INTEGER PRIMARY KEY,'
+                ' user_id TEXT NOT NULL,'
+                ' timestamp TEXT NOT NULL,'
+                ' content TEXT NOT NULL)'
+            )
+
+    def _connection(self):
+        # 每個執行緒各自的連線；fork 後的 worker 重新建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def doc_count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM search_docs').fetchone()[0]
+
+    def _index_doc(self, doc_id, user_id, content):
+        # 呼叫時需持有 self._lock
+        user_postings = self._postings.setdefault(user_id, {})
+        for token in set(tokenize(content)):
+            user_postings.setdefault(token, []).append(doc_id)
+        self._last_id = max(self._last_id, doc_id)
+
+    def _catch_up(self):
+        """把其他 worker (或本程序) 新增的訊息加入記憶體中的索引"""
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT id, user_id, content FROM search_docs WHERE id > ? ORDER BY id',
+                (self._last_id,)
+            ).fetchall()
+            for doc_id, user_id, content in rows:
+                self._index_doc(doc_id, user_id, content)
+
+    def record(self, rows):
+        """儲存成功的 listener：索引文字訊息"""
+        docs = [(row[1], str(row[0]), row[3]) for row in rows if row[2] == 'text' and row[3]]
+        if not docs:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO search_docs (user_id, timestamp, content) VALUES (?, ?, ?)', docs)
+        self._catch_up()
+
+    def search(self, user_id, query, limit=5):
+        """搜尋使用者自己的訊息，所有關鍵字都要出現，回傳 (符合數量, [(時間戳記, 內容)])，新的在前"""
+        tokens = set(tokenize(query))
+        if not tokens:
+            return 0, []
+        self._catch_up()
+
+        with self._lock:
+            user_postings = self._postings.get(user_id, {})
+            matches = None
+            for token in tokens:
+                if len(token) == 1 and TOKEN_PATTERN.match(token).group(1):
+                    # 單一中日韓文字：合併所有包含該字的 bigram
+                    ids = set()
+                    for indexed, postings in user_postings.items():
+                        if token in indexed:
+                            ids.update(postings)
+                else:
+                    ids = set(user_postings.get(token, ()))
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return 0, []
+
+        doc_ids = sorted(matches, reverse=True)[:limit]
+        placeholders = ','.join('?' * len(doc_ids))
+        docs = self._connection().execute(
+            f'SELECT timestamp, content FROM search_docs WHERE id IN ({placeholders}) ORDER BY id DESC',
+            doc_ids
+        ).fetchall()
+        return len(matches), docs
+
+    def load(self):
+        """載入索引檔並補上之後新增的訊息；索引檔不存在或損毀時從 SQLite 重新建立"""
+        started = time.monotonic()
+        try:
+            with gzip.open(self.snapshot_path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != INDEX_FORMAT_VERSION:
+                raise ValueError(f"不支援的索引版本 {snapshot.get('version')}")
+            max_id = self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM search_docs').fetchone()[0]
+            if snapshot['last_id'] > max_id:
+                raise ValueError("索引檔比本地資料新 (本地資料已被清除)")
+            postings = {
+                user_id: {token: _delta_decode(deltas) for token, deltas in tokens.items()}
+                for user_id, tokens in snapshot['users'].items()
+            }
+            with self._lock:
+                self._postings = postings
+                self._last_id = snapshot['last_id']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"搜尋索引檔無法讀取，從本地資料重新建立: {e}")
+            with self._lock:
+                self._postings = {}
+                self._last_id = 0
+
+        self._catch_up()
+        logger.info(f"搜尋索引載入完成: 已索引到訊息 {self._last_id}，耗時 {time.monotonic() - started:.2f}s")
+
+    def save(self):
+        """以 gzip JSON 存檔，posting list 以差值編碼；先寫入暫存檔再取代，避免寫到一半的檔案"""
+        self._catch_up()
+        with self._lock:
+            snapshot = {
+                'version': INDEX_FORMAT_VERSION,
+                'last_id': self._last_id,
+                'users': {
+                    user_id: {token: _delta_encode(ids) for token, ids in tokens.items()}
+                    for user_id, tokens in self._postings.items()
+                },
+            }
+        temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, self.snapshot_path)
+        logger.info(f"搜尋索引已存檔: {self.snapshot_path} ({os.path.getsize(self.snapshot_path)} bytes)")
+
+    def start_rebuild(self):
+        """清除所有訊息與索引，回傳逐列接收原始紀錄的 IndexRebuild，可和其他重建共用同一次讀取"""
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM search_docs')
+        with self._lock:
+            self._postings = {}
+            self._last_id = 0
+        return IndexRebuild(self)
+
+    def rebuild_from_sheet(self, service, spreadsheet_id):
+        """串流讀取 Google Sheets 的原始紀錄，重新建立所有文字訊息與索引，回傳訊息數"""
+        rebuild = self.start_rebuild()
+        for _, row in iter_sheet_rows(service, spreadsheet_id):
+            rebuild.add(row)
+        return rebuild.finish()
+
+    def _insert_docs(self, docs):
+        if not docs:
+            return 0
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO search_docs (user_id, timestamp, content) VALUES (?, ?, ?)', docs)
+        return len(docs)
+
+
+
+class IndexRebuild:
+    """由 SearchIndex.start_rebuild() 建立：add() 逐列收集文字訊息並分批寫入，finish() 建立索引並存檔，回傳訊息數"""
+
+    def __init__(self, index):
+        self.index = index
+        self.batch = []
+        self.total = 0
+        self.started = time.monotonic()
+
+    def add(self, row):
+        if row[2] != 'text' or not row[3]:
+            return
+        self.batch.append((str(row[1]), str(row[0]), str(row[3])))
+        if len(self.batch) >= REBUILD_BATCH_ROWS:
+            self.total += self.index._insert_docs(self.batch)
+            self.batch = []
+
+    def finish(self):
+        self.total += self.index._insert_docs(self.batch)
+        self.batch = []
+        self.index._catch_up()
+        self.index.save()
+        logger.info(f"搜尋索引重建完成: {self.total} 則文字訊息，耗時 {time.monotonic() - self.started:.1f}s")
+        return self.total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='從 Google Sheets 重建 /search 使用的搜尋索引')
+    parser.add_argument('--auth', choices=['oauth', 'service-account'], default='oauth',
+                        help='Google 認證方式 (預設: oauth)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    load_dotenv()
+
+    from export_sheet import create_sheets_handler
+    sheets_handler = create_sheets_handler(args.auth)
+    if not sheets_handler.SPREADSHEET_ID:
+        print("❌ 錯誤：未設定 GOOGLE_SPREADSHEET_ID 環境變數")
+        sys.exit(1)
+
+    total = SearchIndex().rebuild_from_sheet(sheets_handler.service, sheets_handler.SPREADSHEET_ID)
+    print(f"✅ 已索引 {total} 則文字訊息")
+
+
+if __name__ == "__main__":
+    main()
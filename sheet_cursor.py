@@ -0,0 +1,124 @@
+import os
+import threading
+import logging
+from googleapiclient.errors import HttpError
+from sheet_row import encode_json_body, with_json_body
+
+logger = logging.getLogger(__name__)
+
+
+def _cell(value):
+    """轉成 updateCells 的 CellData；字串不經解析 (等同 valueInputOption=RAW)"""
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+class CursorRowWriter:
+    """以本地的下一列游標直接寫入明確位置 (spreadsheets().batchUpdate)
+
+    values().append 每次都要在伺服器端偵測表格結尾，表格越大越慢；
+    這裡只在啟動時讀取一次 A 欄來決定下一列，之後在本地遞增。
+    每次寫入在同一個 batchUpdate 中先 insertDimension 插入新列再 updateCells 填入資料，
+    整個 batchUpdate 是原子操作：游標位置若已有其他寫入者的資料，會被往下推而不會被覆蓋。
+    每 check_every 次寫入檢查游標之後是否有其他寫入者的資料，有的話重新同步游標，
+    讓之後的資料仍接在表格最後。
+    """
+
+    def __init__(self, backend, check_every=None, max_attempts=3):
+        if check_every is None:
+            check_every = int(os.getenv('SHEETS_CURSOR_CHECK_EVERY', '100'))
+        self.backend = backend
+        self.check_every = check_every
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._next_row = None
+        self._sheet_id = None
+        self._writes = 0
+
+    @property
+    def next_row(self):
+        return self._next_row
+
+    def sync(self):
+        """讀取 A 欄決定下一個空白列"""
+        result = self.backend.service.spreadsheets().values().get(
+            spreadsheetId=self.backend.SPREADSHEET_ID,
+            range='A:A',
+            majorDimension='COLUMNS'
+        ).execute()
+        columns = result.get('values', [])
+        self._next_row = (len(columns[0]) if columns else 0) + 1
+        logger.info(f"寫入游標同步完成，下一列: {self._next_row}")
+        return self._next_row
+
+    def _load_sheet_id(self):
+        spreadsheet = self.backend.service.spreadsheets().get(
+            spreadsheetId=self.backend.SPREADSHEET_ID,
+            fields='sheets.properties.sheetId'
+        ).execute()
+        self._sheet_id = spreadsheet['sheets'][0]['properties']['sheetId']
+
+    def _rows_after_cursor(self):
+        """游標之後 (含) 是否已有資料，有的話代表還有其他寫入者"""
+        result = self.backend.service.spreadsheets().values().get(
+            spreadsheetId=self.backend.SPREADSHEET_ID,
+            range=f"A{self._next_row}:A"
+        ).execute()
+        return bool(result.get('values'))
+
+    def _insert_rows_request(self, first, rows):
+        return {'requests': [
+            {'insertDimension': {
+                'range': {
+                    'sheetId': self._sheet_id,
+                    'dimension': 'ROWS',
+                    'startIndex': first - 1,
+                    'endIndex': first - 1 + len(rows)
+                },
+                # 不沿用上一列 (例如表頭) 的格式
+                'inheritFromBefore': False
+            }},
+            {'updateCells': {
+                'start': {'sheetId': self._sheet_id, 'rowIndex': first - 1, 'columnIndex': 0},
+                'rows': [{'values': [_cell(value) for value in row]} for row in rows],
+                'fields': 'userEnteredValue'
+            }},
+        ]}
+
+    def write_rows(self, rows):
+        """寫入多列資料，回傳寫入的第一列列號"""
+        if not rows:
+            return self._next_row
+        with self._lock:
+            if self._next_row is None:
+                self.sync()
+            if self._sheet_id is None:
+                self._load_sheet_id()
+
+            for attempt in range(self.max_attempts):
+                first = self._next_row
+                try:
+                    request = self.backend.service.spreadsheets().batchUpdate(
+                        spreadsheetId=self.backend.SPREADSHEET_ID
+                    )
+                    with_json_body(request, encode_json_body(self._insert_rows_request(first, rows))).execute()
+                except HttpError as error:
+                    if error.resp.status == 400:
+                        # 其他人刪除了列 (游標超出表格)，重新讀取工作表與游標
+                        logger.warning(f"第 {first} 列無法插入，重新同步游標: {error}")
+                        self._load_sheet_id()
+                        self.sync()
+                        continue
+                    raise
+
+                self._next_row = first + len(rows)
+                self._writes += 1
+                if self.check_every and self._writes % self.check_every == 0 and self._rows_after_cursor():
+                    logger.warning(f"第 {self._next_row} 列之後有其他寫入者的資料，重新同步游標")
+                    self.sync()
+                return first
+
+            raise RuntimeError(f"寫入游標在 {self.max_attempts} 次嘗試後仍無法寫入")
@@ -0,0 +1,154 @@
+import os
+import signal
+import sys
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ShutdownCoordinator:
+    """收到 SIGTERM 時排空進行中的工作，避免重新部署時遺失資料"""
+
+    def __init__(self, drain_timeout=None):
+        if drain_timeout is None:
+            drain_timeout = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '25'))
+        self.drain_timeout = drain_timeout
+
+        self._cond = threading.Condition()
+        self._accepting = True
+        self._drained = False
+        self._next_task_id = 0
+        self._in_flight = {}  # task_id -> 描述
+        self._row_flusher = None
+        self._flushers = []
+        self._row_sources = []
+
+    @property
+    def accepting(self):
+        """是否仍接受新的 webhook"""
+        return self._accepting
+
+    def set_row_flusher(self, flush_rows):
+        """設定最後一次批次寫入待處理資料列的函式，flush_rows(rows) 回傳 True/False"""
+        self._row_flusher = flush_rows
+
+    def register_flusher(self, name, flush):
+        """註冊關閉時需要執行的額外 flush 函式"""
+        self._flushers.append((name, flush))
+
+    def register_row_source(self, take_rows):
+        """註冊關閉時提供待寫入資料列的函式，其資料列會併入最後一次批次寫入"""
+        self._row_sources.append(take_rows)
+
+    def start(self, description):
+        """登記一項進行中的工作，回傳 task_id，完成時呼叫 finish(task_id)"""
+        with self._cond:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._in_flight[task_id] = description
+            return task_id
+
+    def finish(self, task_id):
+        with self._cond:
+            self._in_flight.pop(task_id, None)
+            self._cond.notify_all()
+
+    @contextmanager
+    def track(self, description):
+        """追蹤一項進行中的工作（例如 Drive 上傳），關閉時會等待它完成"""
+        task_id = self.start(description)
+        try:
+            yield
+        finally:
+            self.finish(task_id)
+
+    def begin_drain(self):
+        """停止接受新的 webhook"""
+        with self._cond:
+            if self._accepting:
+                logger.info("開始關閉流程，停止接受新的 webhook")
+            self._accepting = False
+
+    def drain(self, timeout=None):
+        """等待進行中的工作並 flush 待處理資料列，回傳排空結果摘要"""
+        self.begin_drain()
+        if timeout is None:
+            timeout = self.drain_timeout
+
+        with self._cond:
+            if self._drained:
+                return None
+            self._drained = True
+
+            started = time.monotonic()
+            deadline = started + timeout
+            initial = dict(self._in_flight)
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            abandoned = list(self._in_flight.values())
+            finished = [desc for task_id, desc in initial.items() if task_id not in self._in_flight]
+
+        rows = []
+        for take_rows in self._row_sources:
+            try:
+                rows.extend(take_rows())
+            except Exception as e:
+                logger.error(f"關閉時取得待寫入資料列失敗: {e}")
+
+        summary = {
+            'drained': finished,
+            'abandoned': abandoned,
+            'rows_flushed': 0,
+            'rows_abandoned': 0,
+            'elapsed': time.monotonic() - started,
+        }
+
+        if rows:
+            if self._row_flusher and self._flush_rows_safely(rows):
+                summary['rows_flushed'] = len(rows)
+            else:
+                summary['rows_abandoned'] = len(rows)
+                for row in rows:
+                    logger.error(f"關閉時無法寫入的資料列: {row}")
+
+        for name, flush in self._flushers:
+            try:
+                flush()
+                logger.info(f"關閉時已 flush: {name}")
+            except Exception as e:
+                logger.error(f"關閉時 flush {name} 失敗: {e}")
+
+        for desc in finished:
+            logger.info(f"已完成進行中的工作: {desc}")
+        for desc in abandoned:
+            logger.warning(f"超過期限 ({timeout}s)，放棄進行中的工作: {desc}")
+        logger.info(
+            f"關閉排空完成: 完成 {len(finished)} 項、放棄 {len(abandoned)} 項工作，"
+            f"寫入 {summary['rows_flushed']} 列、放棄 {summary['rows_abandoned']} 列，"
+            f"耗時 {summary['elapsed']:.2f}s"
+        )
+        return summary
+
+    def _flush_rows_safely(self, rows):
+        try:
+            return bool(self._row_flusher(rows))
+        except Exception as e:
+            logger.error(f"關閉時批次寫入資料列失敗: {e}")
+            return False
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """註冊訊號處理：排空後結束程序"""
+        def _handle(signum, frame):
+            logger.info(f"收到訊號 {signum}，開始排空進行中的工作")
+            self.drain()
+            sys.exit(0)
+
+        for sig in signals:
+            signal.signal(sig, _handle)
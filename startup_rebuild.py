@@ -0,0 +1,146 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StartupRebuild:
+    """啟動後在背景執行緒從 Google Sheets 重建本地的衍生資料 (搜尋索引、每日統計)
+
+    gunicorn preload 時 app 在 master 載入，在 import 時重建會讓 master 遲遲無法產生 worker。
+    改為每個 worker 啟動後呼叫 start()：多個 worker 共用同一份 SQLite，只有取得租約的 worker
+    讀取原始紀錄，其他 worker 等待完成標記；持有租約的 worker 中途結束時租約過期，由其他 worker 接手。
+    原始紀錄只以 read_rows() 讀取一次，每列交給所有 consumer。
+    完成前 ready 未設定，/readyz 回傳 503。
+    """
+
+    def __init__(self, read_rows, path=None, lease_timeout=60, poll_interval=1):
+        self.read_rows = read_rows
+        self.path = path or os.getenv('STARTUP_DB_PATH', 'startup_state.db')
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        # preload 時在 master 建立，同一次啟動的所有 worker (包含之後回收重啟的) 都相同
+        self.run_id = f"{os.getpid()}-{time.time()}"
+        self.ready = threading.Event()
+        self._consumers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS startup_rebuild ('
+                ' run_id TEXT PRIMARY KEY,'
+                ' owner INTEGER NOT NULL,'
+                ' expires REAL NOT NULL,'
+                ' results TEXT)'
+            )
+
+    def _connection(self):
+        # 每個執行緒各自的連線；fork 後的 worker 重新建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add_consumer(self, name, start, on_ready):
+        """start() 回傳有 add(row) 與 finish() 的重建物件，finish() 回傳 False 或拋出例外視為失敗；
+        on_ready(成功與否) 在每個 worker 重建完成後呼叫，例如註冊儲存 listener
+        """
+        self._consumers.append((name, start, on_ready))
+
+    def start(self):
+        """在目前的程序啟動背景重建 (gunicorn 的 post_worker_init 呼叫)，重複呼叫不會重複執行"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        if not self._consumers:
+            self.ready.set()
+            return
+        threading.Thread(target=self._run, name='startup-rebuild', daemon=True).start()
+
+    def _acquire_lease(self):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO startup_rebuild (run_id, owner, expires) VALUES (?, ?, ?)'
+                ' ON CONFLICT(run_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires'
+                ' WHERE startup_rebuild.results IS NULL'
+                ' AND (startup_rebuild.owner = excluded.owner OR startup_rebuild.expires < ?)',
+                (self.run_id, os.getpid(), now + self.lease_timeout, now)
+            )
+        return cursor.rowcount == 1
+
+    def _results(self):
+        row = self._connection().execute(
+            'SELECT results FROM startup_rebuild WHERE run_id = ?', (self.run_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def _run(self):
+        while True:
+            results = self._results()
+            if results is not None:
+                break
+            if self._acquire_lease():
+                results = self._rebuild()
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        'UPDATE startup_rebuild SET results = ? WHERE run_id = ?',
+                        (json.dumps(results), self.run_id)
+                    )
+                    # 之前啟動留下的紀錄已不需要
+                    conn.execute('DELETE FROM startup_rebuild WHERE run_id != ?', (self.run_id,))
+                break
+            time.sleep(self.poll_interval)
+
+        for name, _, on_ready in self._consumers:
+            try:
+                on_ready(results.get(name, False))
+            except Exception as e:
+                logger.error(f"{name} 啟用失敗: {e}")
+        self.ready.set()
+
+    def _rebuild(self):
+        """讀取一次原始紀錄交給所有 consumer，回傳 {名稱: 成功與否}"""
+        started = time.monotonic()
+        results = {name: False for name, _, _ in self._consumers}
+        rebuilds = {}
+        for name, start, _ in self._consumers:
+            try:
+                rebuilds[name] = start()
+            except Exception as e:
+                logger.error(f"{name} 重建失敗: {e}")
+
+        renewed = time.monotonic()
+        scanned = 0
+        try:
+            for row in self.read_rows():
+                scanned += 1
+                for rebuild in rebuilds.values():
+                    rebuild.add(row)
+                if time.monotonic() - renewed > self.lease_timeout / 3:
+                    self._acquire_lease()
+                    renewed = time.monotonic()
+        except Exception as e:
+            logger.error(f"讀取原始紀錄失敗，{', '.join(rebuilds)} 重建失敗: {e}")
+            return results
+
+        for name, rebuild in rebuilds.items():
+            try:
+                results[name] = rebuild.finish() is not False
+            except Exception as e:
+                logger.error(f"{name} 重建失敗: {e}")
+        logger.info(f"啟動重建完成: 掃描 {scanned} 列，耗時 {time.monotonic() - started:.1f}s")
+        return results
@@ -0,0 +1,373 @@
+import os
+import sqlite3
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from circuit_breaker import CircuitBreaker
+from sheet_cursor import CursorRowWriter
+from tracing import tracer
+from sheet_row import SheetRow, encode_json_body, with_json_body
+
+logger = logging.getLogger(__name__)
+
+HEADERS = ['時間戳記', '使用者ID', '訊息類型', '內容', '額外資訊']
+
+
+class StorageBackend:
+    """訊息儲存後端的共同介面
+
+    資料列為 SheetRow (時間戳記, 使用者ID, 訊息類型, 內容, 額外資訊)。
+    子類別至少需實作 append_rows；可上傳檔案的後端另外實作 upload_image / upload_media。
+    """
+
+    name = 'storage'
+    _save_listeners = ()
+
+    def append_rows(self, rows):
+        """批次寫入多列資料，成功回傳 True"""
+        raise NotImplementedError
+
+    def add_save_listener(self, listener):
+        """註冊寫入成功後呼叫的 listener(rows)，例如每日統計"""
+        self._save_listeners = tuple(self._save_listeners) + (listener,)
+
+    def _notify_saved(self, rows):
+        for listener in self._save_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.error(f"儲存 listener 執行失敗: {e}")
+
+    def create_headers(self):
+        """建立表頭，不需要表頭的後端直接回傳 True"""
+        return True
+
+    def upload_image(self, image_data, message_id):
+        """上傳圖片，回傳 (內容描述, 圖片連結)"""
+        return f"圖片大小: {len(image_data)} bytes", ''
+
+    def upload_media(self, chunks, message_id, message_type, mimetype, file_name=None, size=None):
+        """串流上傳影片/語音/檔案，回傳 (內容描述, 檔案連結)"""
+        raise NotImplementedError
+
+    def save_message(self, user_id, message, message_type, timestamp):
+        """儲存訊息"""
+        try:
+            return bool(self.append_rows([SheetRow(timestamp, user_id, message_type, message)]))
+        except Exception as error:
+            logger.error(f"Error saving message to {self.name}: {error}")
+            return False
+
+    def save_image(self, user_id, image_data, message_id, timestamp):
+        """上傳圖片並儲存連結，回傳圖片連結，失敗時回傳 None"""
+        try:
+            image_info, image_url = self.upload_image(image_data, message_id)
+            if not self.append_rows([SheetRow(timestamp, user_id, 'image', image_info, image_url)]):
+                return None
+            return image_url
+        except HttpError as error:
+            if error.resp.status == 403:
+                logger.error("權限不足：請確認 Google API 範圍包含 Drive 存取權限")
+            else:
+                logger.error(f"Google API error: {error}")
+            return None
+        except Exception as error:
+            logger.error(f"Error saving image to {self.name}: {error}")
+            return None
+
+    def save_media(self, user_id, chunks, message_id, message_type, mimetype, timestamp,
+                   file_name=None, size=None):
+        """串流上傳影片/語音/檔案並儲存連結，回傳檔案連結，失敗時回傳 None"""
+        try:
+            media_info, media_url = self.upload_media(
+                chunks, message_id, message_type, mimetype, file_name, size)
+            if not self.append_rows([SheetRow(timestamp, user_id, message_type, media_info, media_url)]):
+                return None
+            return media_url
+        except HttpError as error:
+            if 'storageQuotaExceeded' in str(error):
+                logger.error("帳戶沒有儲存配額，無法上傳影片/語音/檔案")
+            else:
+                logger.error(f"Google Drive API error: {error}")
+            return None
+        except Exception as error:
+            logger.error(f"Error saving {message_type} to {self.name}: {error}")
+            return None
+
+    def breaker_states(self):
+        """各上游服務的斷路器狀態"""
+        return {}
+
+    def close(self):
+        pass
+
+
+class SheetsStorageBackend(StorageBackend):
+    """Google Sheets 後端的共同實作，子類別負責認證 (self.creds) 與檔案上傳"""
+
+    name = 'google_sheets'
+
+    def __init__(self):
+        self.SPREADSHEET_ID = os.getenv('GOOGLE_SPREADSHEET_ID')
+        self.DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')  # 可選，用於指定儲存資料夾
+        self.RANGE_NAME = 'A:E'  # 預設範圍: A到E欄
+        self.creds = None
+        self._local = threading.local()
+        self.drive_breaker = CircuitBreaker('drive', probe=self._probe_drive)
+        # append: values().append (預設)；cursor: 以本地游標在明確位置插入新列
+        self.WRITE_MODE = os.getenv('SHEETS_WRITE_MODE', 'append')
+        if self.WRITE_MODE == 'cursor' and int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+            # 每個 worker 各自的游標會讓資料交錯插入，順序錯亂
+            logger.error("游標寫入模式只支援單一 worker (WEB_CONCURRENCY=1)，改用 values().append")
+            self.WRITE_MODE = 'append'
+        self.cursor_writer = CursorRowWriter(self) if self.WRITE_MODE == 'cursor' else None
+
+    def _probe_drive(self):
+        """探測 Drive 是否可用：storageQuota 沒有上限或尚未用盡"""
+        about = self.drive_service.about().get(fields='storageQuota').execute()
+        quota = about.get('storageQuota', {})
+        limit = quota.get('limit')
+        return limit is None or int(quota.get('usage', 0)) < int(limit)
+
+    def breaker_states(self):
+        return {'drive': self.drive_breaker.snapshot()}
+
+    def _thread_clients(self):
+        # 每個執行緒各自的 client；gunicorn preload 時 master 建立的 client 會隨 fork 複製到 worker，
+        # 共用同一個 httplib2 連線 socket，所以 fork 後的 worker 需要重新建立
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.__dict__.clear()
+            local.pid = os.getpid()
+        return local
+
+    @property
+    def service(self):
+        """Google Sheets client，httplib2 不是 thread-safe，所以每個執行緒各自建立"""
+        local = self._thread_clients()
+        if not hasattr(local, 'service'):
+            local.service = self._create_sheets_service()
+        return local.service
+
+    @property
+    def drive_service(self):
+        """Google Drive client，每個執行緒各自建立"""
+        local = self._thread_clients()
+        if not hasattr(local, 'drive_service'):
+            local.drive_service = self._create_drive_service()
+        return local.drive_service
+
+    def _create_sheets_service(self):
+        return build('sheets', 'v4', credentials=self.creds)
+
+    def _create_drive_service(self):
+        return build('drive', 'v3', credentials=self.creds)
+
+    @tracer.traced('sheets.append_rows', kind='CLIENT')
+    def append_rows(self, rows):
+        """一次批次寫入多列資料到Google Sheets"""
+        if not rows:
+            return True
+        try:
+            if self.cursor_writer:
+                first_row = self.cursor_writer.write_rows(rows)
+                logger.info(f"{len(rows)} rows written to Google Sheets at row {first_row}")
+                self._notify_saved(rows)
+                return True
+
+            # 資料列直接序列化成 request body，不另外建立 dict 再由 client 轉成 JSON
+            request = self.service.spreadsheets().values().append(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=self.RANGE_NAME,
+                valueInputOption='RAW'
+            )
+            result = with_json_body(request, encode_json_body({'values': rows})).execute()
+
+            logger.info(f"{len(rows)} rows appended to Google Sheets: {result.get('updates', {}).get('updatedCells', 0)} cells updated")
+            self._notify_saved(rows)
+            return True
+
+        except HttpError as error:
+            logger.error(f"Google Sheets API error: {error}")
+            return False
+        except Exception as error:
+            logger.error(f"Error appending rows: {error}")
+            return False
+
+    def create_headers(self):
+        """建立Google Sheets的表頭"""
+        try:
+            body = {
+                'values': [HEADERS]
+            }
+
+            self.service.spreadsheets().values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range='A1:E1',
+                valueInputOption='RAW',
+                body=body
+            ).execute()
+
+            logger.info("Headers created in Google Sheets")
+            return True
+
+        except HttpError as error:
+            logger.error(f"Google Sheets API error: {error}")
+            return False
+        except Exception as error:
+            logger.error(f"Error creating headers: {error}")
+            return False
+
+
+class SQLiteSink(StorageBackend):
+    """本地 SQLite 副本，寫入延遲低，方便查詢"""
+
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('SQLITE_PATH', 'messages.db')
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            self._connection()
+        logger.info(f"SQLite 儲存已開啟: {self.path}")
+
+    def _connection(self):
+        # 呼叫時需持有 self._lock；gunicorn preload 後 fork 的 worker 不能共用父程序的連線
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._pid = os.getpid()
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' timestamp TEXT NOT NULL,'
+                ' user_id TEXT NOT NULL,'
+                ' message_type TEXT NOT NULL,'
+                ' content TEXT,'
+                ' extra TEXT)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_messages_user_time ON messages (user_id, timestamp)')
+            self._conn.commit()
+        return self._conn
+
+    @tracer.traced('sqlite.append_rows')
+    def append_rows(self, rows):
+        if not rows:
+            return True
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO messages (timestamp, user_id, message_type, content, extra)'
+                        ' VALUES (?, ?, ?, ?, ?)',
+                        rows
+                    )
+            return True
+        except sqlite3.Error as error:
+            logger.error(f"SQLite error: {error}")
+            return False
+
+    def query(self, sql, params=()):
+        """在本地副本上執行查詢"""
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class FanOutStorage(StorageBackend):
+    """同時寫入多個後端
+
+    主要後端 (通常是 Google Sheets) 在呼叫端執行緒同步寫入，結果作為回傳值；
+    其他後端各自有一個背景執行緒依序寫入，較慢的後端不會增加其他後端的延遲。
+    檔案上傳只交給主要後端，取得連結後的資料列再寫入所有後端。
+    """
+
+    name = 'fan_out'
+
+    def __init__(self, primary, secondaries):
+        self.primary = primary
+        self.secondaries = list(secondaries)
+        # 每個次要後端一個執行緒，保持各自的寫入順序
+        self._executors = {
+            id(sink): ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sink-{sink.name}")
+            for sink in self.secondaries
+        }
+
+    def __getattr__(self, name):
+        # SPREADSHEET_ID、service 等屬性沿用主要後端
+        if name == 'primary' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.primary, name)
+
+    def _write_secondaries(self, rows):
+        for sink in self.secondaries:
+            # 複製 context，背景寫入仍記錄在同一個 trace 中
+            future = self._executors[id(sink)].submit(contextvars.copy_context().run, sink.append_rows, rows)
+            future.add_done_callback(lambda f, sink=sink: self._log_result(sink, f))
+
+    @staticmethod
+    def _log_result(sink, future):
+        try:
+            if not future.result():
+                logger.error(f"寫入 {sink.name} 失敗")
+        except Exception as e:
+            logger.error(f"寫入 {sink.name} 失敗: {e}")
+
+    def append_rows(self, rows):
+        if not rows:
+            return True
+        self._write_secondaries(rows)
+        return self.primary.append_rows(rows)
+
+    def create_headers(self):
+        return self.primary.create_headers()
+
+    def add_save_listener(self, listener):
+        # 以主要後端 (Google Sheets) 寫入成功為準
+        self.primary.add_save_listener(listener)
+
+    def breaker_states(self):
+        return self.primary.breaker_states()
+
+    def upload_image(self, image_data, message_id):
+        return self.primary.upload_image(image_data, message_id)
+
+    def upload_media(self, chunks, message_id, message_type, mimetype, file_name=None, size=None):
+        return self.primary.upload_media(chunks, message_id, message_type, mimetype, file_name, size)
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        for sink in [self.primary] + self.secondaries:
+            sink.close()
+
+
+def create_storage_backend():
+    """依環境變數建立儲存後端
+
+    GOOGLE_AUTH_MODE: oauth (預設) 或 service_account
+    SQLITE_PATH: 設定後同時寫入本地 SQLite 副本
+    """
+    if os.getenv('GOOGLE_AUTH_MODE', 'oauth') == 'service_account':
+        from google_sheets import GoogleSheetsHandler
+        primary = GoogleSheetsHandler()
+    else:
+        from google_sheets_oauth import GoogleSheetsOAuthHandler
+        primary = GoogleSheetsOAuthHandler()
+
+    if os.getenv('SQLITE_PATH'):
+        return FanOutStorage(primary, [SQLiteSink(os.getenv('SQLITE_PATH'))])
+    return primary
@@ -0,0 +1,76 @@
+from circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_open_half_open_probe_closed():
+    clock = FakeClock()
+    probes = []
+    healthy = [False]
+
+    def probe():
+        probes.append(clock.now)
+        return healthy[0]
+
+    breaker = CircuitBreaker('drive', failure_threshold=2, reset_timeout=30, probe=probe, clock=clock)
+    assert breaker.allow_request()
+
+    breaker.record_failure('HTTP 500')
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure('HTTP 500')
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()['retry_in'] == 30
+
+    # 期限到後進入 half_open，探測失敗再次開啟並重新計時
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert probes == [1030.0]
+
+    clock.now += 30
+    healthy[0] = True
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()['failures'] == 0
+    assert breaker.snapshot()['skipped_requests'] == 2
+
+
+def test_half_open_without_probe_lets_one_request_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker('imgbb', failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure('HTTP 503')
+
+    clock.now += 10
+    assert breaker.allow_request()
+    # 探測請求進行中，其他請求被略過
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_open_for_overrides_reset_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker('drive', failure_threshold=3, reset_timeout=10, clock=clock)
+    breaker.record_failure('storageQuotaExceeded', open_for=3600)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 10
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 3590
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_snapshot_does_not_expose_exception_text():
+    breaker = CircuitBreaker('imgbb', failure_threshold=1)
+    breaker.record_failure(ConnectionError('https://api.imgbb.com/1/upload?key=secret'))
+
+    assert breaker.snapshot()['last_error'] == 'ConnectionError'
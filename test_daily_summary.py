@@ -0,0 +1,104 @@
+import re
+
+from daily_summary import DailySummary
+from sheet_row import SheetRow
+
+
+class FakeSummaryTab:
+    """只支援 DailySummary 用到的 API 的假 Google Sheets，資料存在 self.rows (第 1 列為 rows[0])"""
+
+    def __init__(self):
+        self.rows = []
+        self._call = None
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, fields=None):
+        if fields is not None:
+            self._call = ('sheet', None)
+        else:
+            self._call = ('get', range)
+        return self
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        # 原始紀錄為空
+        self._call = ('batchGet', None)
+        return self
+
+    def batchUpdate(self, spreadsheetId, body):
+        self._call = ('batchUpdate', body)
+        return self
+
+    def clear(self, spreadsheetId, range):
+        self._call = ('clear', range)
+        return self
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        self._call = ('append', body)
+        return self
+
+    def execute(self):
+        call, arg = self._call
+        if call == 'sheet':
+            return {'sheets': [{'properties': {
+                'sheetId': 1, 'title': '每日統計', 'gridProperties': {'rowCount': 1000}}}]}
+        if call == 'batchGet':
+            return {'valueRanges': []}
+        if call == 'get':
+            return {'values': [row[:2] for row in self.rows]}
+        if call == 'clear':
+            self.rows = []
+        elif call == 'append':
+            self.rows.extend(arg['values'])
+        elif call == 'batchUpdate':
+            for data in arg.get('data', []):
+                first = int(re.search(r'!A(\d+)', data['range']).group(1))
+                for offset, values in enumerate(data['values']):
+                    index = first - 1 + offset
+                    self.rows.extend([] for _ in range(index + 1 - len(self.rows)))
+                    self.rows[index] = values
+        return {}
+
+
+class FakeBackend:
+    SPREADSHEET_ID = 'sheet'
+
+    def __init__(self):
+        self.service = FakeSummaryTab()
+
+
+def test_flush_writes_by_key_after_rows_move(tmp_path):
+    backend = FakeBackend()
+    summary = DailySummary(backend, sheet_title='每日統計', path=str(tmp_path / 'summary.db'), flush_interval=60)
+    summary._ensure_started = lambda: None
+    summary.rebuild()
+
+    summary.record([SheetRow('2024-01-01 09:00:00', 'U2', 'text', 'a')])
+    summary.record([SheetRow('2024-01-01 10:00:00', 'U1', 'image', 'b')])
+    assert summary.flush()
+    assert backend.service.rows == [
+        ['日期', '使用者ID', '文字', '圖片'], ['2024-01-01', 'U1', 0, 1], ['2024-01-01', 'U2', 1, 0]]
+
+    # 其他容器重建分頁後列的順序改變，且多了一位只在該容器出現的使用者
+    backend.service.rows = [
+        backend.service.rows[0], ['2024-01-01', 'U0', 5, 0], ['2024-01-01', 'U2', 1, 0], ['2024-01-01', 'U1', 0, 1]]
+
+    summary.record([SheetRow('2024-01-01 11:00:00', 'U2', 'text', 'c')])
+    summary.record([SheetRow('2024-01-02 08:00:00', 'U1', 'text', 'd')])
+    assert summary.flush()
+    assert backend.service.rows[1:] == [
+        ['2024-01-01', 'U0', 5, 0], ['2024-01-01', 'U2', 2, 0], ['2024-01-01', 'U1', 0, 1], ['2024-01-02', 'U1', 1, 0]]
+
+
+def test_flush_without_changes_does_not_touch_tab(tmp_path):
+    backend = FakeBackend()
+    summary = DailySummary(backend, sheet_title='每日統計', path=str(tmp_path / 'summary.db'), flush_interval=60)
+    summary.rebuild()
+    backend.service.rows.append(['other', 'data', 0, 0])
+
+    assert summary.flush()
+    assert backend.service.rows[-1] == ['other', 'data', 0, 0]
@@ -0,0 +1,105 @@
+import pytest
+import requests
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import drive_stream_upload
+from drive_stream_upload import (
+    CHUNK_ALIGNMENT, SourceStreamError, StreamingMediaUpload, upload_stream_to_drive,
+)
+
+CHUNK = CHUNK_ALIGNMENT
+
+
+def line_chunks(total, fail_after=None, piece=100 * 1024):
+    """模擬 LINE 內容下載的 iter_content；fail_after 之後拋出下載中斷的例外"""
+    sent = 0
+    while sent < total:
+        if fail_after is not None and sent >= fail_after:
+            raise requests.exceptions.ChunkedEncodingError('connection broken')
+        size = min(piece, total - sent)
+        yield bytes([sent % 251]) * size
+        sent += size
+
+
+def drive_with_responses(*responses):
+    http = HttpMockSequence(list(responses))
+    return build('drive', 'v3', developerKey='test', http=http), http
+
+
+def started():
+    return ({'status': '200', 'location': 'https://upload.example/session'}, b'')
+
+
+def accepted(last_byte):
+    return ({'status': '308', 'range': f"bytes=0-{last_byte}"}, b'')
+
+
+def finished(size):
+    return ({'status': '200'}, f'{{"id": "F", "size": "{size}"}}'.encode())
+
+
+def test_getbytes_keeps_unconfirmed_chunk_for_resume():
+    media = StreamingMediaUpload(line_chunks(3 * CHUNK), 'video/mp4', 3 * CHUNK, CHUNK)
+
+    first = media.getbytes(0, CHUNK)
+    # 同一段重送 (Drive 沒有確認) 時回傳相同資料
+    assert media.getbytes(0, CHUNK) == first
+    second = media.getbytes(CHUNK, CHUNK)
+    assert len(second) == CHUNK
+    # 已確認的資料已丟棄，無法倒回
+    with pytest.raises(ValueError):
+        media.getbytes(0, CHUNK)
+
+
+def test_source_error_is_not_treated_as_end_of_stream():
+    media = StreamingMediaUpload(line_chunks(3 * CHUNK, fail_after=CHUNK), 'video/mp4', 3 * CHUNK, CHUNK)
+    media.getbytes(0, CHUNK)
+
+    with pytest.raises(SourceStreamError):
+        media.getbytes(CHUNK, CHUNK)
+    # 再次讀取 (例如重試) 也不會回傳不足的資料
+    with pytest.raises(SourceStreamError):
+        media.getbytes(CHUNK, CHUNK)
+
+
+def test_stream_shorter_than_declared_size_raises():
+    media = StreamingMediaUpload(line_chunks(CHUNK + 10), 'video/mp4', 2 * CHUNK, CHUNK)
+    media.getbytes(0, CHUNK)
+
+    with pytest.raises(SourceStreamError, match=str(CHUNK + 10)):
+        media.getbytes(CHUNK, CHUNK)
+
+
+def test_upload_resumes_after_drive_error(monkeypatch):
+    monkeypatch.setattr(drive_stream_upload.time, 'sleep', lambda seconds: None)
+    total = 2 * CHUNK + 1000
+    drive, http = drive_with_responses(
+        started(),
+        accepted(CHUNK - 1),
+        ({'status': '503'}, b'unavailable'),
+        # 重試時先查詢狀態，再從已確認的位置續傳
+        accepted(CHUNK - 1),
+        accepted(2 * CHUNK - 1),
+        finished(total),
+    )
+    media = StreamingMediaUpload(line_chunks(total), 'video/mp4', total, CHUNK)
+
+    result = upload_stream_to_drive(drive, {'name': 'v.mp4'}, media, fields='id,size')
+
+    assert result == {'id': 'F', 'size': str(total)}
+
+
+def test_source_failure_aborts_upload_without_retry(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(drive_stream_upload.time, 'sleep', sleeps.append)
+    total = 10 * CHUNK
+    drive, http = drive_with_responses(started(), accepted(CHUNK - 1), finished(CHUNK + 1))
+    media = StreamingMediaUpload(line_chunks(total, fail_after=CHUNK), 'video/mp4', total, CHUNK)
+
+    with pytest.raises(SourceStreamError):
+        upload_stream_to_drive(drive, {'name': 'v.mp4'}, media, fields='id,size')
+
+    # 沒有重試，也沒有把截斷的檔案送出完成
+    assert sleeps == []
+    assert len(http._iterable) == 1
@@ -0,0 +1,61 @@
+from export_sheet import iter_sheet_rows
+
+
+class FakeSheet:
+    """依列號回傳資料的假 Sheets service，模擬 values().batchGet 省略範圍尾端空白列"""
+
+    def __init__(self, rows):
+        self.rows = rows  # 列號 -> 欄位
+        self.calls = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        self.calls += 1
+        self._ranges = ranges
+        return self
+
+    def execute(self):
+        value_ranges = []
+        for a1 in self._ranges:
+            first, last = (int(part[1:]) for part in a1.split(':'))
+            values = [self.rows.get(row, []) for row in range(first, last + 1)]
+            while values and not values[-1]:
+                values.pop()
+            value_ranges.append({'range': a1, 'values': values} if values else {'range': a1})
+        return {'valueRanges': value_ranges}
+
+
+def test_continues_past_short_range():
+    # 第 4-6 列空白：第一個範圍 (2-4) 不滿，但之後還有資料
+    rows = {2: ['t2', 'u', 'text', 'a'], 3: ['t3', 'u', 'text', 'b'], 7: ['t7', 'u', 'image', 'c', 'url']}
+    service = FakeSheet(rows)
+
+    result = list(iter_sheet_rows(service, 'sheet', chunk_rows=3, ranges_per_call=2))
+
+    assert [number for number, row in result if row[0]] == [2, 3, 7]
+    assert result[0][1] == ['t2', 'u', 'text', 'a', '']
+    assert result[-1] == (7, ['t7', 'u', 'image', 'c', 'url'])
+
+
+def test_stops_after_empty_batch():
+    rows = {row: [f"t{row}", 'u', 'text', 'x'] for row in range(2, 12)}
+    service = FakeSheet(rows)
+
+    result = list(iter_sheet_rows(service, 'sheet', chunk_rows=3, ranges_per_call=2))
+
+    assert [number for number, _ in result] == list(range(2, 12))
+    # 2-7, 8-13 有資料，14-19 全空後停止
+    assert service.calls == 3
+
+
+def test_interior_blank_rows_keep_row_numbers():
+    rows = {2: ['t2', 'u', 'text', 'a'], 4: ['t4', 'u', 'text', 'b']}
+
+    result = list(iter_sheet_rows(FakeSheet(rows), 'sheet', start_row=2, chunk_rows=5, ranges_per_call=1))
+
+    assert [(number, row[0]) for number, row in result] == [(2, 't2'), (3, ''), (4, 't4')]
@@ -0,0 +1,79 @@
+import threading
+
+from fair_scheduler import FairScheduler, UserRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_in_order(scheduler, submissions):
+    """先以一個工作佔住唯一的執行緒，排好所有工作後再放行，回傳實際執行順序"""
+    gate = threading.Event()
+    order = []
+    blocker = scheduler.submit('blocker', gate.wait)
+    futures = [scheduler.submit(user_id, lambda name=name: order.append(name), cost)
+               for user_id, name, cost in submissions]
+    gate.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_heavy_user_does_not_starve_others():
+    scheduler = FairScheduler(workers=1)
+    submissions = [('heavy', f"h{i}", 1) for i in range(6)] + [('light', 'l0', 1), ('light', 'l1', 1)]
+
+    order = run_in_order(scheduler, submissions)
+
+    # 輪流服務：light 的工作不會排在 heavy 的 6 筆之後
+    assert order[:4] == ['h0', 'l0', 'h1', 'l1']
+    assert order[4:] == ['h2', 'h3', 'h4', 'h5']
+    scheduler.shutdown()
+
+
+def test_cost_is_weighted_by_deficit():
+    scheduler = FairScheduler(workers=1)
+    # media 每筆成本 3，text 每筆成本 1：每輪兩者各得 1 額度，media 累積 3 輪才執行一筆，
+    # 即使 media 先提交也不會讓 text 排在後面
+    submissions = [('media', f"m{i}", 3) for i in range(2)] + [('text', f"t{i}", 1) for i in range(6)]
+
+    order = run_in_order(scheduler, submissions)
+
+    assert order == ['t0', 'm0', 't1', 't2', 'm1', 't3', 't4', 't5']
+    scheduler.shutdown()
+
+
+def test_pending_counts_running_and_queued():
+    scheduler = FairScheduler(workers=1)
+    gate = threading.Event()
+    running = scheduler.submit('U1', gate.wait)
+    queued = scheduler.submit('U2', lambda: None)
+
+    assert scheduler.pending() == 2
+    gate.set()
+    running.result(timeout=5)
+    queued.result(timeout=5)
+    scheduler.shutdown()
+    assert scheduler.pending() == 0
+
+
+def test_rate_limiter_is_shared_through_sqlite(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / 'rate_limits.db')
+    first = UserRateLimiter(rate_per_minute=60, burst=3, path=path, clock=clock)
+    second = UserRateLimiter(rate_per_minute=60, burst=3, path=path, clock=clock)
+
+    # 兩個實例 (例如兩個 worker) 共用同一個權杖桶
+    assert [first.try_acquire('U1'), second.try_acquire('U1'), first.try_acquire('U1')] == [True] * 3
+    assert not second.try_acquire('U1')
+    assert first.try_acquire('U2')
+
+    clock.now += 1
+    assert second.try_acquire('U1')
+    assert not first.try_acquire('U1')
@@ -0,0 +1,143 @@
+import pytest
+
+import import_line_history
+from import_line_history import HistoryImporter, ImportCheckpoint, parse_line_history
+
+ZH_EXPORT = """[LINE] 與工作群組的聊天記錄
+儲存日期：2024/01/02 10:00
+
+2024/01/01（一）
+上午12:05\tAlice\t新年快樂
+下午01:20\tBob\t[照片]
+下午12:30\tBob\t[貼圖]
+下午03:00\tAlice加入群組
+這行不屬於任何訊息
+2024/01/02（二）
+上午09:15\tCarol\t早安
+"""
+
+EN_EXPORT = """[LINE] Chat history with Bob
+Saved on: 2024/03/06 08:00
+
+2024/03/05(Tue)
+12:10 AM\tBob\tup late
+1:20 PM\tBob\t[Photo]
+12:45 PM\tAlice\tlunch?
+09:00\tAlice\t[Voice message]
+"""
+
+
+def parse(text):
+    return list(parse_line_history(text.splitlines(keepends=True)))
+
+
+def test_zh_export_meridiem_dates_and_types():
+    assert parse(ZH_EXPORT) == [
+        ('2024-01-01 00:05:00', 'Alice', 'text', '新年快樂'),
+        ('2024-01-01 13:20:00', 'Bob', 'image', '[照片]'),
+        ('2024-01-01 12:30:00', 'Bob', 'sticker', '[貼圖]'),
+        ('2024-01-02 09:15:00', 'Carol', 'text', '早安'),
+    ]
+
+
+def test_en_export_meridiem_suffix_and_24_hour_times():
+    assert parse(EN_EXPORT) == [
+        ('2024-03-05 00:10:00', 'Bob', 'text', 'up late'),
+        ('2024-03-05 13:20:00', 'Bob', 'image', '[Photo]'),
+        ('2024-03-05 12:45:00', 'Alice', 'text', 'lunch?'),
+        ('2024-03-05 09:00:00', 'Alice', 'audio', '[Voice message]'),
+    ]
+
+
+def test_quoted_multiline_message():
+    text = (
+        "2024.01.01 星期一\n"
+        "09:15\tAlice\t\"第一行\n"
+        "他說 \"\"好\"\"\n"
+        "最後一行\"\n"
+        "\n"
+        "\n"
+        "09:20\tBob\t收到\n"
+    )
+    assert parse(text) == [
+        ('2024-01-01 09:15:00', 'Alice', 'text', '第一行\n他說 "好"\n最後一行'),
+        ('2024-01-01 09:20:00', 'Bob', 'text', '收到'),
+    ]
+
+
+def test_unquoted_continuation_lines_are_kept():
+    text = "2024/01/01(Mon)\n09:15\tAlice\t清單\n- 牛奶\n- 雞蛋\n2024/01/02(Tue)\n"
+    assert parse(text) == [('2024-01-01 09:15:00', 'Alice', 'text', '清單\n- 牛奶\n- 雞蛋')]
+
+
+def test_system_line_ends_message():
+    text = "2024/01/01(Mon)\n09:15\tAlice\thi\n09:16\tBob已收回訊息\nstray text\n"
+    assert parse(text) == [('2024-01-01 09:15:00', 'Alice', 'text', 'hi')]
+
+
+class FakeSheetsHandler:
+    """記錄每次 append_rows 的假後端；fail_on 指定第幾次呼叫 (從 1 起算) 回傳 False"""
+
+    def __init__(self, fail_on=()):
+        self.batches = []
+        self.calls = 0
+        self.fail_on = set(fail_on)
+
+    def append_rows(self, rows):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            return False
+        self.batches.append([list(row) for row in rows])
+        return True
+
+
+def write_export(tmp_path, count):
+    path = tmp_path / 'chat.txt'
+    lines = ['2024/01/01(Mon)'] + [f"09:{minute:02d}\tAlice\tmessage {minute}" for minute in range(count)]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def test_import_writes_batches_and_updates_checkpoint(tmp_path):
+    path = write_export(tmp_path, 5)
+    checkpoint = ImportCheckpoint(str(tmp_path / 'checkpoint.json'))
+    handler = FakeSheetsHandler()
+
+    importer = HistoryImporter(handler, checkpoint, batch_rows=2, min_interval=0)
+
+    assert importer.import_file(path, {'Alice': 'U1'}) == 5
+    assert [len(batch) for batch in handler.batches] == [2, 2, 1]
+    assert handler.batches[0][0] == ['2024-01-01 09:00:00', 'U1', 'text', 'message 0', 'LINE 匯入: chat.txt']
+    assert ImportCheckpoint(checkpoint.path).rows_done(path) == 5
+
+
+def test_import_resumes_from_checkpoint(tmp_path):
+    path = write_export(tmp_path, 5)
+    checkpoint = ImportCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.update(path, 3)
+    handler = FakeSheetsHandler()
+
+    importer = HistoryImporter(handler, ImportCheckpoint(checkpoint.path), batch_rows=2, min_interval=0)
+
+    assert importer.import_file(path) == 2
+    assert [row[3] for batch in handler.batches for row in batch] == ['message 3', 'message 4']
+    assert ImportCheckpoint(checkpoint.path).rows_done(path) == 5
+
+
+def test_failed_batch_keeps_checkpoint_for_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(import_line_history.time, 'sleep', lambda seconds: None)
+    path = write_export(tmp_path, 5)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    handler = FakeSheetsHandler(fail_on={2})
+
+    importer = HistoryImporter(handler, ImportCheckpoint(checkpoint_path), batch_rows=2,
+                               min_interval=0, max_retries=0)
+    with pytest.raises(RuntimeError):
+        importer.import_file(path)
+    assert ImportCheckpoint(checkpoint_path).rows_done(path) == 2
+
+    # 重新執行時從第 3 則訊息繼續，不重複寫入
+    retry = HistoryImporter(handler, ImportCheckpoint(checkpoint_path), batch_rows=2, min_interval=0)
+    assert retry.import_file(path) == 3
+    written = [row[3] for batch in handler.batches for row in batch]
+    assert written == [f"message {minute}" for minute in range(5)]
@@ -0,0 +1,57 @@
+from search_index import SearchIndex, tokenize, _delta_decode, _delta_encode
+from sheet_row import SheetRow
+
+
+def make_index(tmp_path):
+    return SearchIndex(path=str(tmp_path / 'search.db'), snapshot_path=str(tmp_path / 'search.json.gz'))
+
+
+def test_tokenize_uses_cjk_bigrams_and_lowercase_words():
+    assert tokenize('明天開會 Budget Review') == ['明天', '天開', '開會', 'budget', 'review']
+    assert tokenize('好') == ['好']
+    # 全形英數字經 NFKC 正規化
+    assert tokenize('ＡＢＣ會議') == ['abc', '會議']
+
+
+def test_delta_encoding_round_trip():
+    ids = [3, 7, 8, 20]
+    assert _delta_encode(ids) == [3, 4, 1, 12]
+    assert _delta_decode(_delta_encode(ids)) == ids
+
+
+def test_search_cjk_bigrams_per_user(tmp_path):
+    index = make_index(tmp_path)
+    index.record([
+        SheetRow('2024-01-01 09:00:00', 'U1', 'text', '明天下午三點開會'),
+        SheetRow('2024-01-01 10:00:00', 'U1', 'text', '會議記錄已上傳'),
+        SheetRow('2024-01-01 11:00:00', 'U2', 'text', '明天開會'),
+        SheetRow('2024-01-01 12:00:00', 'U1', 'image', '圖片大小: 10 bytes', 'https://drive'),
+    ])
+
+    total, docs = index.search('U1', '開會')
+    assert total == 1
+    assert docs == [('2024-01-01 09:00:00', '明天下午三點開會')]
+
+    # 單一字比對所有包含該字的 bigram，新的在前
+    total, docs = index.search('U1', '會')
+    assert total == 2
+    assert [content for _, content in docs] == ['會議記錄已上傳', '明天下午三點開會']
+
+    # 所有關鍵字都要出現
+    assert index.search('U1', '明天 記錄') == (0, [])
+    # 只搜尋自己的訊息
+    assert index.search('U2', '記錄') == (0, [])
+
+
+def test_snapshot_reload_catches_up_new_messages(tmp_path):
+    index = make_index(tmp_path)
+    index.record([SheetRow('2024-01-01 09:00:00', 'U1', 'text', 'quarterly report')])
+    index.save()
+    index.record([SheetRow('2024-01-02 09:00:00', 'U1', 'text', 'report draft')])
+
+    reloaded = make_index(tmp_path)
+    reloaded.load()
+
+    total, docs = reloaded.search('U1', 'report')
+    assert total == 2
+    assert docs[0] == ('2024-01-02 09:00:00', 'report draft')
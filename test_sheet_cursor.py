@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+
+from sheet_cursor import CursorRowWriter
+
+
+class FakeSheet:
+    """只支援 CursorRowWriter 用到的 API 的假 Google Sheets，資料存在 self.rows (第 1 列為 rows[0])"""
+
+    def __init__(self, rows):
+        self.rows = [list(row) for row in rows]
+        self.batch_updates = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, fields=None, majorDimension=None):
+        if fields is not None:
+            return FakeRequest(lambda request: {'sheets': [{'properties': {'sheetId': 7}}]})
+        if range == 'A:A':
+            return FakeRequest(lambda request: {'values': [[row[0] for row in self.rows]]} if self.rows else {})
+        first = int(range[1:].split(':')[0])
+        return FakeRequest(lambda request: {'values': [[row[0]] for row in self.rows[first - 1:]]})
+
+    def batchUpdate(self, spreadsheetId):
+        return FakeRequest(self._apply_batch_update)
+
+    def _apply_batch_update(self, request):
+        body = json.loads(request.body)
+        self.batch_updates.append(body)
+        for item in body['requests']:
+            if 'insertDimension' in item:
+                span = item['insertDimension']['range']
+                self.rows[span['startIndex']:span['startIndex']] = [
+                    [] for _ in range(span['endIndex'] - span['startIndex'])]
+            else:
+                update = item['updateCells']
+                for offset, row in enumerate(update['rows']):
+                    self.rows[update['start']['rowIndex'] + offset] = [
+                        next(iter(cell['userEnteredValue'].values())) for cell in row['values']]
+        return {}
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self._result = result
+        self.headers = {}
+        self.body = None
+
+    def execute(self):
+        return self._result(self)
+
+
+def make_writer(sheet, check_every=100):
+    backend = SimpleNamespace(service=sheet, SPREADSHEET_ID='S')
+    return CursorRowWriter(backend, check_every=check_every)
+
+
+def test_write_inserts_and_fills_rows_in_one_batch_update():
+    sheet = FakeSheet([['時間'], ['t1', 'U1']])
+    writer = make_writer(sheet)
+
+    assert writer.write_rows([['t2', 'U2', 3], ['t3', 'U3', 'x']]) == 3
+
+    assert sheet.rows[2:] == [['t2', 'U2', 3], ['t3', 'U3', 'x']]
+    assert writer.next_row == 5
+    [body] = sheet.batch_updates
+    insert, update = body['requests']
+    assert insert['insertDimension']['range'] == {
+        'sheetId': 7, 'dimension': 'ROWS', 'startIndex': 2, 'endIndex': 4}
+    assert update['updateCells']['start'] == {'sheetId': 7, 'rowIndex': 2, 'columnIndex': 0}
+    assert update['updateCells']['rows'][0]['values'][2] == {'userEnteredValue': {'numberValue': 3}}
+
+
+def test_other_writers_rows_are_pushed_down_not_overwritten():
+    sheet = FakeSheet([['時間'], ['t1']])
+    writer = make_writer(sheet)
+    writer.sync()
+    # 游標同步之後，其他寫入者在同一列寫入了資料
+    sheet.rows.append(['other'])
+
+    writer.write_rows([['mine']])
+
+    assert sheet.rows == [['時間'], ['t1'], ['mine'], ['other']]
+
+
+def test_periodic_check_resyncs_cursor_after_other_writers():
+    sheet = FakeSheet([['時間']])
+    writer = make_writer(sheet, check_every=2)
+    writer.write_rows([['a']])
+    sheet.rows.append(['other'])
+
+    writer.write_rows([['b']])
+
+    assert writer.next_row == 5
+    writer.write_rows([['c']])
+    assert sheet.rows == [['時間'], ['a'], ['b'], ['other'], ['c']]
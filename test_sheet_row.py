@@ -0,0 +1,45 @@
+import json
+
+import httplib2
+from googleapiclient.discovery import build
+
+from sheet_row import SheetRow, encode_json_body, with_json_body
+
+
+class RecordingHttp:
+    """記錄送出的 request，回傳空的成功回應"""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        self.requests.append({'uri': uri, 'method': method, 'body': body, 'headers': headers})
+        return httplib2.Response({'status': '200'}), b'{}'
+
+
+def test_sheet_row_defaults_and_json():
+    row = SheetRow('2024-01-01 12:00:00', 'U1', 'text', '會議記錄')
+
+    assert row.extra == ''
+    assert row[2] == 'text'
+    assert encode_json_body({'values': [row]}) == (
+        '{"values":[["2024-01-01 12:00:00","U1","text","會議記錄",""]]}'.encode('utf-8'))
+
+
+def test_with_json_body_sends_preencoded_body():
+    # 以實際的 googleapiclient 建立 request，確認 with_json_body 依賴的行為沒有改變
+    http = RecordingHttp()
+    service = build('sheets', 'v4', developerKey='test', http=http)
+    rows = [SheetRow('2024-01-01 12:00:00', 'U1', 'text', '你好')]
+    body = encode_json_body({'values': rows})
+
+    request = service.spreadsheets().values().append(
+        spreadsheetId='sheet', range='A:E', valueInputOption='RAW')
+    with_json_body(request, body).execute()
+
+    sent = http.requests[0]
+    assert sent['method'] == 'POST'
+    assert sent['body'] is body
+    assert sent['headers']['content-type'] == 'application/json'
+    assert sent['headers']['content-length'] == str(len(body))
+    assert json.loads(sent['body']) == {'values': [['2024-01-01 12:00:00', 'U1', 'text', '你好', '']]}
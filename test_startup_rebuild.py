@@ -0,0 +1,77 @@
+from startup_rebuild import StartupRebuild
+
+
+class FakeRebuild:
+    def __init__(self, result=True):
+        self.rows = []
+        self.result = result
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def finish(self):
+        return self.result
+
+
+def make_rebuild(tmp_path, rows, reads):
+    def read_rows():
+        reads.append(1)
+        return iter(rows)
+    return StartupRebuild(read_rows, path=str(tmp_path / 'startup.db'), poll_interval=0.01)
+
+
+def test_rows_are_read_once_for_all_consumers(tmp_path):
+    rows = [['t1', 'U1', 'text', 'a', ''], ['t2', 'U1', 'image', '', 'f']]
+    reads = []
+    summary, index = FakeRebuild(), FakeRebuild(result=False)
+    ready = {}
+    startup = make_rebuild(tmp_path, rows, reads)
+    startup.add_consumer('summary', lambda: summary, lambda ok: ready.setdefault('summary', ok))
+    startup.add_consumer('index', lambda: index, lambda ok: ready.setdefault('index', ok))
+
+    assert not startup.ready.is_set()
+    startup.start()
+
+    assert startup.ready.wait(5)
+    assert reads == [1]
+    assert summary.rows == rows and index.rows == rows
+    assert ready == {'summary': True, 'index': False}
+
+
+def test_other_worker_waits_for_results_instead_of_rereading(tmp_path):
+    reads = []
+    owner = make_rebuild(tmp_path, [['t1', 'U1', 'text', 'a', '']], reads)
+    owner.add_consumer('summary', FakeRebuild, lambda ok: None)
+    owner.start()
+    assert owner.ready.wait(5)
+
+    # 同一次啟動的另一個 worker：run_id 相同，但在不同的程序中
+    worker = make_rebuild(tmp_path, [], reads)
+    worker.run_id = owner.run_id
+    ready = []
+    worker.add_consumer('summary', FakeRebuild, ready.append)
+    worker._run()
+
+    assert reads == [1]
+    assert ready == [True]
+
+
+def test_read_failure_marks_every_consumer_failed(tmp_path):
+    def read_rows():
+        raise OSError('connection reset')
+        yield
+
+    ready = {}
+    startup = StartupRebuild(read_rows, path=str(tmp_path / 'startup.db'))
+    startup.add_consumer('summary', FakeRebuild, lambda ok: ready.setdefault('summary', ok))
+    startup.add_consumer('index', FakeRebuild, lambda ok: ready.setdefault('index', ok))
+    startup._run()
+
+    assert startup.ready.is_set()
+    assert ready == {'summary': False, 'index': False}
+
+
+def test_ready_without_consumers(tmp_path):
+    startup = StartupRebuild(lambda: iter(()), path=str(tmp_path / 'startup.db'))
+    startup.start()
+    assert startup.ready.is_set()
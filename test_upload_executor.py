@@ -0,0 +1,144 @@
+import time
+import threading
+
+import pytest
+
+from shutdown import ShutdownCoordinator
+from upload_executor import OrderedUploadExecutor
+
+
+class RecordingCommit:
+    def __init__(self, result=True):
+        self.batches = []
+        self.result = result
+
+    def __call__(self, rows):
+        self.batches.append(list(rows))
+        return self.result
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+def gated_upload(row, gate=None):
+    """gate 設定後才完成的上傳；未指定 gate 時立即完成"""
+    def upload():
+        if gate is not None:
+            assert gate.wait(5)
+        return row, f"url-{row}"
+    return upload
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_rows_commit_in_submit_order_when_uploads_finish_out_of_order():
+    commit = RecordingCommit()
+    executor = OrderedUploadExecutor(commit, max_workers=3)
+    gates = [threading.Event() for _ in range(3)]
+    futures = [executor.submit('U1', gated_upload(f"row{i}", gates[i])) for i in range(3)]
+    jobs = list(executor._queues['U1'])
+
+    # 後提交的先上傳完成：第一筆完成前都不能寫入
+    gates[2].set()
+    gates[1].set()
+    wait_until(lambda: jobs[1].uploaded and jobs[2].uploaded)
+    assert commit.batches == []
+    assert not any(future.done() for future in futures)
+
+    gates[0].set()
+    assert [future.result(timeout=5) for future in futures] == [
+        ('url-row0', True), ('url-row1', True), ('url-row2', True)]
+    assert commit.rows == ['row0', 'row1', 'row2']
+    executor.shutdown()
+
+
+def test_users_do_not_wait_for_each_other():
+    commit = RecordingCommit()
+    executor = OrderedUploadExecutor(commit, max_workers=2)
+    gate = threading.Event()
+    slow = executor.submit('U1', gated_upload('slow', gate))
+    fast = executor.submit('U2', gated_upload('fast'))
+
+    assert fast.result(timeout=5) == ('url-fast', True)
+    assert not slow.done()
+    gate.set()
+    assert slow.result(timeout=5) == ('url-slow', True)
+    executor.shutdown()
+
+
+def test_failed_upload_does_not_block_later_rows():
+    commit = RecordingCommit()
+    executor = OrderedUploadExecutor(commit, max_workers=2)
+    gate = threading.Event()
+
+    def failing():
+        assert gate.wait(5)
+        raise RuntimeError('drive down')
+
+    failed = executor.submit('U1', failing)
+    after = executor.submit('U1', gated_upload('after'))
+    gate.set()
+
+    with pytest.raises(RuntimeError, match='drive down'):
+        failed.result(timeout=5)
+    assert after.result(timeout=5) == ('url-after', True)
+    assert commit.rows == ['after']
+    executor.shutdown()
+
+
+def test_commit_failure_is_reported_per_job():
+    executor = OrderedUploadExecutor(RecordingCommit(result=False), max_workers=1)
+    no_row = executor.submit('U1', lambda: (None, 'skipped'))
+    with_row = executor.submit('U1', gated_upload('row'))
+
+    # 不需寫入的工作視為成功，寫入失敗的回傳 False
+    assert no_row.result(timeout=5) == ('skipped', True)
+    assert with_row.result(timeout=5) == ('url-row', False)
+    executor.shutdown()
+
+
+def test_drain_flushes_rows_waiting_behind_unfinished_upload():
+    commit = RecordingCommit()
+    executor = OrderedUploadExecutor(commit, max_workers=2)
+    stuck = threading.Event()
+    executor.submit('U1', gated_upload('stuck', stuck))
+    waiting = executor.submit('U1', gated_upload('waiting'))
+    waiting_job = executor._queues['U1'][1]
+    wait_until(lambda: waiting_job.uploaded)
+
+    flushed = []
+    coordinator = ShutdownCoordinator(drain_timeout=0.1)
+    coordinator.set_row_flusher(lambda rows: flushed.extend(rows) or True)
+    coordinator.register_row_source(executor.take_uploaded_rows)
+    summary = coordinator.drain()
+
+    assert flushed == ['waiting']
+    assert summary['rows_flushed'] == 1
+
+    # 關閉時已寫入的資料列不會在前一筆完成後重複寫入
+    stuck.set()
+    assert waiting.result(timeout=5) == ('url-waiting', True)
+    assert commit.rows == ['stuck']
+    executor.shutdown()
+
+
+def test_scheduler_lane_keeps_order():
+    from fair_scheduler import FairScheduler
+
+    commit = RecordingCommit()
+    scheduler = FairScheduler(workers=2)
+    executor = OrderedUploadExecutor(commit, scheduler=scheduler, upload_cost=3)
+    futures = [executor.submit('U1', gated_upload(f"row{i}")) for i in range(5)]
+
+    assert [future.result(timeout=5)[1] for future in futures] == [True] * 5
+    assert commit.rows == [f"row{i}" for i in range(5)]
+    assert executor.max_workers == 2
+    with pytest.raises(ValueError):
+        OrderedUploadExecutor(commit, max_workers=4, scheduler=scheduler)
+    scheduler.shutdown()
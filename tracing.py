@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import random
+import inspect
+import threading
+import contextvars
+import logging
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'linebot-sheets'
+
+
+class Span:
+    """一個追蹤區段，結束時轉成 Zipkin v2 JSON"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'timestamp', '_start', 'tags')
+
+    def __init__(self, trace_id, parent_id, name, kind=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.timestamp = int(time.time() * 1_000_000)
+        self._start = time.perf_counter()
+        self.tags = {}
+
+    def tag(self, key, value):
+        self.tags[key] = str(value)
+
+    def to_zipkin(self, service_name):
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': max(1, int((time.perf_counter() - self._start) * 1_000_000)),
+            'localEndpoint': {'serviceName': service_name},
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        if self.tags:
+            span['tags'] = self.tags
+        return span
+
+
+class _NoopSpan:
+    """未取樣時使用，tag() 不做任何事"""
+
+    __slots__ = ()
+
+    def tag(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# 目前執行緒 (或 contextvars context) 中進行中的 span；未取樣的 trace 為 NOOP_SPAN
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class ZipkinExporter:
+    """在背景執行緒批次輸出 span
+
+    path: 每行一個 Zipkin v2 span JSON (可用 jq -s 合併後匯入 Zipkin / Jaeger)
+    url: POST 到 Zipkin 相容的 collector，例如 http://localhost:9411/api/v2/spans
+    """
+
+    def __init__(self, path=None, url=None, flush_interval=2.0, max_queue=10000, batch_size=500):
+        self.path = path
+        self.url = url
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._queue = deque(maxlen=max_queue)  # 超過上限時丟棄最舊的 span，不阻塞請求
+        self._write_lock = threading.Lock()
+        self._pid = None
+
+    def export(self, span):
+        with self._cond:
+            self._ensure_started()
+            self._queue.append(span)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_started(self):
+        # 呼叫時需持有 self._cond；gunicorn fork 後的 worker 需要重新建立背景執行緒
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """輸出所有等待中的 span"""
+        with self._write_lock:
+            while True:
+                with self._cond:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.warning(f"輸出 {len(batch)} 個追蹤 span 失敗: {e}")
+                    return
+
+    def _write(self, batch):
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for span in batch:
+                    f.write(json.dumps(span, ensure_ascii=False))
+                    f.write('\n')
+        if self.url:
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(batch).encode('utf-8'),
+                headers={'Content-Type': 'application/json'},
+                method='POST'
+            )
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+
+
+class Tracer:
+    """取樣式追蹤
+
+    最外層的 span (例如 POST /callback) 依 sample_rate 決定整個 trace 是否記錄，
+    子 span 沿用同一個決定。span 存在 contextvars 中，交給其他執行緒的工作
+    需透過 wrap() 或複製 context 才會接在同一個 trace 下。
+    """
+
+    def __init__(self, exporter=None, sample_rate=None, service_name=None):
+        if exporter is None:
+            path = os.getenv('TRACE_EXPORT_PATH')
+            url = os.getenv('TRACE_ZIPKIN_URL')
+            exporter = ZipkinExporter(path=path, url=url) if (path or url) else None
+        if sample_rate is None:
+            sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter else 0.0
+        self.service_name = service_name or os.getenv('TRACE_SERVICE_NAME', SERVICE_NAME)
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    @contextmanager
+    def span(self, name, kind=None, **tags):
+        """記錄一個區段；例外會記錄在 error tag 後繼續往外拋"""
+        parent = _current_span.get()
+        if not self.enabled or parent is NOOP_SPAN:
+            yield NOOP_SPAN
+            return
+
+        if parent is None:
+            if random.random() >= self.sample_rate:
+                token = _current_span.set(NOOP_SPAN)
+                try:
+                    yield NOOP_SPAN
+                finally:
+                    _current_span.reset(token)
+                return
+            span = Span(f"{random.getrandbits(128):032x}", None, name, kind)
+        else:
+            span = Span(parent.trace_id, parent.span_id, name, kind)
+
+        for key, value in tags.items():
+            span.tag(key, value)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.tag('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            self.exporter.export(span.to_zipkin(self.service_name))
+
+    def traced(self, name=None, kind=None):
+        """將函式包成一個 span 的 decorator"""
+        def decorator(fn):
+            span_name = name or fn.__name__
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, kind):
+                    return fn(*args, **kwargs)
+            # 保留原本的參數簽章；LINE WebhookHandler 依參數數量決定是否傳入 destination
+            wrapper.__signature__ = inspect.signature(fn)
+            return wrapper
+        return decorator
+
+    def wrap(self, fn):
+        """綁定目前的 trace，讓 callback 在其他執行緒執行時仍接在同一個 trace 下"""
+        context = contextvars.copy_context()
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return context.run(fn, *args, **kwargs)
+        return wrapper
+
+    def flush(self):
+        if self.exporter:
+            self.exporter.flush()
+
+
+tracer = Tracer()
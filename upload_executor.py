@@ -0,0 +1,120 @@
+import os
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_WORKERS = 4
+
+
+class _UploadJob:
+    __slots__ = ('upload', 'future', 'row', 'result', 'error', 'uploaded')
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.future = Future()
+        self.row = None
+        self.result = None
+        self.error = None
+        self.uploaded = False
+
+
+class OrderedUploadExecutor:
+    """平行執行上傳，但每個使用者的 Google Sheets 資料列仍依照訊息順序寫入
+
+    upload() 回傳 (資料列, 結果)；資料列為 None 時代表不需寫入 Sheets。
+    上傳完成後，只有該使用者排在最前面且已完成的工作會被寫入，
+    連續完成的多筆會合併成一次 append。
+    指定 scheduler (FairScheduler) 時上傳改由它在使用者之間公平排程，不另外建立執行緒，
+    並行數由 scheduler 的工作執行緒數決定 (不能同時指定 max_workers)；
+    未指定時使用 max_workers (預設 UPLOAD_WORKERS) 個執行緒。
+    """
+
+    def __init__(self, commit_rows, max_workers=None, scheduler=None, upload_cost=1):
+        if scheduler is not None and max_workers is not None:
+            raise ValueError("max_workers 只適用於未指定 scheduler 的情況")
+        self._commit_rows = commit_rows
+        self._scheduler = scheduler
+        self._upload_cost = upload_cost
+        self._pool = None
+        if scheduler is None:
+            if max_workers is None:
+                max_workers = int(os.getenv('UPLOAD_WORKERS', DEFAULT_UPLOAD_WORKERS))
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+        self.max_workers = scheduler.workers if scheduler is not None else max_workers
+        self._lock = threading.Lock()
+        self._queues = {}  # user_id -> deque[_UploadJob]，依提交順序
+        self._committing = set()
+
+    def submit(self, user_id, upload):
+        """提交上傳工作，回傳 Future，結果為 (upload 結果, 是否已寫入 Sheets)"""
+        job = _UploadJob(upload)
+        with self._lock:
+            self._queues.setdefault(user_id, deque()).append(job)
+        if self._scheduler is not None:
+            self._scheduler.submit(user_id, lambda: self._run(user_id, job), self._upload_cost)
+        else:
+            self._pool.submit(contextvars.copy_context().run, self._run, user_id, job)
+        return job.future
+
+    def _run(self, user_id, job):
+        try:
+            job.row, job.result = job.upload()
+        except Exception as e:
+            logger.error(f"上傳失敗 ({user_id}): {e}")
+            job.error = e
+        with self._lock:
+            job.uploaded = True
+        self._commit_ready(user_id)
+
+    def _commit_ready(self, user_id):
+        while True:
+            with self._lock:
+                queue = self._queues.get(user_id)
+                if user_id in self._committing or not queue or not queue[0].uploaded:
+                    return
+                jobs = []
+                while queue and queue[0].uploaded:
+                    jobs.append(queue.popleft())
+                if not queue:
+                    del self._queues[user_id]
+                self._committing.add(user_id)
+
+            try:
+                rows = [job.row for job in jobs if job.error is None and job.row is not None]
+                committed = self._commit_safely(rows)
+                for job in jobs:
+                    if job.error is not None:
+                        job.future.set_exception(job.error)
+                    else:
+                        job.future.set_result((job.result, committed or job.row is None))
+            finally:
+                with self._lock:
+                    self._committing.discard(user_id)
+
+    def _commit_safely(self, rows):
+        if not rows:
+            return True
+        try:
+            return bool(self._commit_rows(rows))
+        except Exception as e:
+            logger.error(f"寫入 {len(rows)} 列到 Google Sheets 失敗: {e}")
+            return False
+
+    def take_uploaded_rows(self):
+        """取出已上傳完成但還在等待前一筆的資料列 (關閉時使用)"""
+        rows = []
+        with self._lock:
+            for queue in self._queues.values():
+                for job in queue:
+                    if job.uploaded and job.error is None and job.row is not None:
+                        rows.append(job.row)
+                        job.row = None
+        return rows
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UserSaveStates:
+    """使用者是否在儲存模式中
+
+    存在 SQLite 檔案中，讓 gunicorn 的多個 worker 程序共用同一份狀態
+    (/save 和之後的訊息可能由不同 worker 處理)。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('USER_STATE_PATH', 'user_states.db')
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS user_save_states ('
+            ' user_id TEXT PRIMARY KEY,'
+            ' saving INTEGER NOT NULL)'
+        )
+        conn.commit()
+
+    def _connection(self):
+        # 每個執行緒各自的連線；fork 後的 worker 重新建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, user_id, default=False):
+        row = self._connection().execute(
+            'SELECT saving FROM user_save_states WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return bool(row[0]) if row else default
+
+    def __setitem__(self, user_id, saving):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO user_save_states (user_id, saving) VALUES (?, ?)'
+                ' ON CONFLICT(user_id) DO UPDATE SET saving = excluded.saving',
+                (user_id, int(bool(saving)))
+            )